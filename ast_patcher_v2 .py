@@ -7,9 +7,10 @@ Features:
 - Root = directory of the currently open editor file (editor.get_path())
 - Patches can target any file under root (including subfolders)
 - Whole-run revert (revert last run)
-- Run storage: patch_runs/<stamp>/ (bundle, manifest, snapshots, logs)
+- Run storage: patch_runs/<stamp>/ (bundle, manifest, snapshots.tar, logs)
 - Prune old runs (keep last N)
 - Compile check + rollback-on-fail (per touched file, best-effort)
+- Parsed-AST / compile cache: patch_runs/.ast_cache/ (keyed by source hash)
 
 Patch bundle format:
 - DEFAULT_FILE <path>          (optional)
@@ -50,12 +51,28 @@ Notes:
 - DRY_RUN=True previews patches without writing anything to disk.
 """
 
+import io
 import os
+import re
 import ast
 import json
 import time
+import sys
+import pickle
 import hashlib
-import textwrap
+import shutil
+import tarfile
+import importlib
+import threading
+from bisect import bisect_right
+from itertools import accumulate
+from functools import lru_cache
+from concurrent.futures import ThreadPoolExecutor
+
+try:
+    import mmap
+except Exception:
+    mmap = None
 
 try:
     import clipboard
@@ -73,10 +90,17 @@ try:
 except Exception:
     editor = None
 
-try:
-    import dialogs
-except Exception:
-    dialogs = None
+# Modules only some code paths need are imported on first use (see _lazy).
+_lazy_modules = {}
+
+def _lazy(name):
+    """Import name once and cache it; None if it isn't available here."""
+    if name not in _lazy_modules:
+        try:
+            _lazy_modules[name] = importlib.import_module(name)
+        except Exception:
+            _lazy_modules[name] = None
+    return _lazy_modules[name]
 
 
 # =========================
@@ -93,6 +117,16 @@ ALWAYS_COPY_RUN_PACKET = True
 
 DRY_RUN = False          # Set True to preview patches without writing to disk
 
+USE_DISK_AST_CACHE = True          # pickle parsed trees under patch_runs/.ast_cache/
+AST_CACHE_DIRNAME = ".ast_cache"
+AST_CACHE_MAX_FILES = 200
+AST_CACHE_TMP_GRACE = 300          # seconds before a leftover cache .tmp counts as abandoned
+
+MANIFEST_INDENT_MAX_RESULTS = 200   # runs with more results get a compact, streamed manifest.json
+
+VERIFY_WORKERS = 4       # threads for write + compile check when a run touches several files
+VERIFY_READBACK = False  # re-read and compare each written file (off: on-disk size check only)
+
 
 # =========================
 # UTIL
@@ -100,27 +134,115 @@ DRY_RUN = False          # Set True to preview patches without writing to disk
 def now_stamp():
     return time.strftime("%Y%m%d_%H%M%S")
 
-def sha256_text(s):
-    return hashlib.sha256((s or "").encode("utf-8")).hexdigest()
+_HASH_CHUNK = 1 << 20   # chars per update(); big sources are encoded a slice at a time
+
+def hash_text(s):
+    """
+    Change-detection hash (BLAKE2b-128, hex). Not used for anything adversarial,
+    so the cheaper primitive is fine.
+    """
+    s = s or ""
+    if len(s) <= _HASH_CHUNK:
+        return hashlib.blake2b(s.encode("utf-8"), digest_size=16).hexdigest()
+    h = hashlib.blake2b(digest_size=16)
+    for i in range(0, len(s), _HASH_CHUNK):
+        h.update(s[i:i + _HASH_CHUNK].encode("utf-8"))
+    return h.hexdigest()
+
+sha256_text = hash_text   # old name, kept for external callers
+
+_HASH_MEMO_MAX = 8
+_hash_memo = {}   # recent source text -> hash_text(); oldest entry evicted first
+_hash_memo_lock = threading.Lock()   # verify workers hash through smoke_compile's cache path
+
+def hash_source(source):
+    """
+    hash_text for whole-file sources and the clipboard bundle. The same text is hashed
+    for cache keys, op records and the manifest, so the last few results are kept.
+    """
+    source = source or ""
+    with _hash_memo_lock:
+        h = _hash_memo.get(source)
+    if h is None:
+        # hash outside the lock so big sources don't serialise the verify pool
+        h = hash_text(source)
+        with _hash_memo_lock:
+            if source not in _hash_memo and len(_hash_memo) >= _HASH_MEMO_MAX:
+                del _hash_memo[next(iter(_hash_memo))]
+            _hash_memo[source] = h
+    return h
 
 def ensure_dir(path):
     if not os.path.isdir(path):
-        os.makedirs(path)
+        os.makedirs(path, exist_ok=True)
 
-def read_text(path):
-    with open(path, "r", encoding="utf-8") as f:
-        return f.read()
+_MMAP_MIN = 1 << 20   # bytes; files at least this big are decoded straight from a mapping
 
-def write_text(path, text):
-    ensure_dir(os.path.dirname(path))
+def read_text(path):
+    if mmap is None or os.stat(path).st_size < _MMAP_MIN:
+        with open(path, "r", encoding="utf-8") as f:
+            return f.read()
+    with open(path, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+        text = str(mm, "utf-8")
+    # same universal-newline translation a text-mode open() does
+    if "\r" in text:
+        text = text.replace("\r\n", "\n").replace("\r", "\n")
+    return text
+
+# realpath -> (st_mtime_ns, st_size, text); dropped whenever write_text touches the path
+_file_text_cache = {}
+
+def read_text_cached(path):
+    """
+    read_text, but reuse the last read while the file's mtime and size are unchanged.
+    Not for write-back verification, which must always hit the disk.
+    """
+    key = os.path.realpath(path)
+    st = os.stat(key)
+    hit = _file_text_cache.get(key)
+    if hit is not None and hit[0] == st.st_mtime_ns and hit[1] == st.st_size:
+        return hit[2]
+    text = read_text(key)
+    _file_text_cache[key] = (st.st_mtime_ns, st.st_size, text)
+    return text
+
+def write_text(path, text, mkdirs=True):
+    if mkdirs:
+        ensure_dir(os.path.dirname(path))
+    _file_text_cache.pop(os.path.realpath(path), None)
     with open(path, "w", encoding="utf-8") as f:
         f.write(text)
 
+_INDENT_RE = re.compile(r'[ \t]*')
+
 def get_line_indent(line):
-    return line[:len(line) - len(line.lstrip())]
+    # leading spaces/tabs only, matched without materialising an lstrip() copy
+    return _INDENT_RE.match(line).group(0)
+
+def indent_width(line):
+    # len(get_line_indent(line)) without building the indent string
+    return _INDENT_RE.match(line).end()
+
+def strip_eol(line):
+    # one splitlines(True) element -> the matching splitlines() element
+    return line.splitlines()[0] if line else line
+
+def normalize_ws(line):
+    # MATCH: fuzzy comparison form: whitespace runs collapsed, ends trimmed
+    return ' '.join(line.split())
 
 def smoke_compile(source, filename="<patched>"):
-    compile(source, filename, "exec")
+    # An (empty) marker file on disk means this exact source compiled before.
+    path = _disk_cache_path(source or "", ".code")
+    if _disk_cache_hit(path):
+        return True
+    # If apply_ops already parsed this revision, compile that tree: skips re-tokenizing
+    # but keeps the symtable/codegen checks ast.parse alone would miss.
+    tree = _parse_cache.get(_source_key(source))
+    # syntax check only: optimize=2 skips emitting docstrings and asserts
+    code = compile(source if tree is None else tree, filename, "exec",
+                   dont_inherit=True, optimize=2)
+    _disk_cache_store(path, lambda _c, f: None, code)
     return True
 
 def get_excerpt(source, line1, line2, context=DEFAULT_CONTEXT_LINES):
@@ -128,165 +250,341 @@ def get_excerpt(source, line1, line2, context=DEFAULT_CONTEXT_LINES):
     n = len(lines)
     a = max(1, line1 - context)
     b = min(n, line2 + context)
-    out = []
-    for i in range(a, b + 1):
-        prefix = ">> " if (line1 <= i <= line2) else "   "
-        out.append(f"{prefix}{i:04d}: {lines[i-1]}")
+    # pre-context / hit / post-context, clamped to [a, b] so the prefix is constant per slice
+    hit_a = max(a, line1)
+    hit_b = min(b, line2)
+    out = [f"   {i:04d}: {lines[i-1]}" for i in range(a, min(line1, b + 1))]
+    out += [f">> {i:04d}: {lines[i-1]}" for i in range(hit_a, hit_b + 1)]
+    out += [f"   {i:04d}: {lines[i-1]}" for i in range(max(a, line2 + 1, hit_a), b + 1)]
     return "\n".join(out)
 
-def _hud(msg, style="success", d=1.0):
-    if console:
-        try:
-            console.hud_alert(msg, style, d)
-        except Exception:
-            pass
-    else:
-        print(msg)
+# UI / editor shims: bound once at import to the Pythonista or console variant,
+# so calls don't re-check which modules are available.
+def _hud_console(msg, style="success", d=1.0):
+    try:
+        console.hud_alert(msg, style, d)
+    except Exception:
+        pass
+
+def _hud_print(msg, style="success", d=1.0):
+    print(msg)
 
-def _alert(title, message, *buttons):
+def _alert_console(title, message, *buttons):
     # returns 1..n
-    if console:
-        try:
-            return console.alert(title, message, *buttons)
-        except Exception:
-            return 1
+    try:
+        return console.alert(title, message, *buttons)
+    except Exception:
+        return 1
+
+def _alert_print(title, message, *buttons):
     print(title + ":", message)
     return 1
 
-def _editor_path():
-    if editor:
-        try:
-            return editor.get_path()
-        except Exception:
-            return None
+def _editor_path_real():
+    try:
+        return editor.get_path()
+    except Exception:
+        return None
+
+def _editor_text_real():
+    try:
+        return editor.get_text() or ""
+    except Exception:
+        return ""
+
+def _editor_replace_all_real(text):
+    try:
+        cur = editor.get_text() or ""
+        editor.replace_text(0, len(cur), text)
+        return True
+    except Exception:
+        return False
+
+def _editor_path_none():
     return None
 
-def _editor_text():
-    if editor:
-        try:
-            return editor.get_text() or ""
-        except Exception:
-            return ""
+def _editor_text_none():
     return ""
 
-def _editor_replace_all(text):
-    if editor:
-        try:
-            cur = editor.get_text() or ""
-            editor.replace_text(0, len(cur), text)
-            return True
-        except Exception:
-            return False
+def _editor_replace_all_none(text):
     return False
 
+if console:
+    _hud, _alert = _hud_console, _alert_console
+else:
+    _hud, _alert = _hud_print, _alert_print
+
+if editor:
+    _editor_path, _editor_text, _editor_replace_all = (
+        _editor_path_real, _editor_text_real, _editor_replace_all_real)
+else:
+    _editor_path, _editor_text, _editor_replace_all = (
+        _editor_path_none, _editor_text_none, _editor_replace_all_none)
+
 
 # =========================
 # AST LOCATOR
 # =========================
-def supports_end_lineno():
-    src = "def f():\n    return 1\n"
-    t = ast.parse(src)
-    fn = t.body[0]
-    return hasattr(fn, "end_lineno") and fn.end_lineno is not None
+_parse_cache = {}   # (hex digest, len) -> ast.Module; cleared at the start of each run
+_index_cache = {}   # (hex digest, len) -> build_symbol_index() result; cleared with _parse_cache
+_disk_cache_dir = None   # set per run by set_disk_cache_dir(); None disables
+_disk_cache_writable = False
+
+# Interpreter tag baked into disk cache keys so a Python upgrade invalidates them
+_CACHE_TAG = "py%d%d" % (sys.version_info[0], sys.version_info[1])
+
+def set_disk_cache_dir(path, writable=True):
+    """Dry runs pass writable=False: they may read the cache but never add to it."""
+    global _disk_cache_dir, _disk_cache_writable
+    _disk_cache_dir = path if USE_DISK_AST_CACHE else None
+    _disk_cache_writable = bool(writable)
+
+def _disk_cache_path(source, ext):
+    if not _disk_cache_dir:
+        return None
+    return os.path.join(_disk_cache_dir, hash_text(_CACHE_TAG + "\0" + hash_source(source)) + ext)
 
-def find_method_range(source, class_name, method_name):
+def _disk_cache_hit(path):
+    # Bump mtime on every hit: prune_ast_cache keeps the newest mtimes, so eviction
+    # goes by last use rather than by when the entry was written.
+    if not path or not os.path.isfile(path):
+        return False
+    try:
+        os.utime(path, None)
+    except OSError:
+        pass
+    return True
+
+def _disk_cache_load(path, loader):
+    if not _disk_cache_hit(path):
+        return None
+    try:
+        with open(path, "rb") as f:
+            return loader(f)
+    except Exception:
+        return None
+
+def _disk_cache_store(path, dumper, obj):
+    if not path or not _disk_cache_writable:
+        return
+    try:
+        ensure_dir(os.path.dirname(path))
+        tmp = "%s.%d.%x.tmp" % (path, os.getpid(), threading.get_ident())   # one per writer thread
+        with open(tmp, "wb") as f:
+            dumper(obj, f)
+        os.replace(tmp, path)
+    except Exception:
+        pass
+
+def _ast_parse(source):
+    # Flags pinned explicitly: the locators only read lineno/end_lineno/name/targets,
+    # so type comments are never needed (and must not become a default by accident).
+    return ast.parse(source, mode="exec", type_comments=False)
+
+def load_or_parse(source):
     """
-    Return (start_line, end_line) 1-based inclusive for a method inside a top-level class.
+    ast.parse() backed by the on-disk cache: a hit is an unpickle instead of a
+    full tokenize + parse. Any cache problem falls back to a plain parse.
+    """
+    path = _disk_cache_path(source, ".ast")
+    tree = _disk_cache_load(path, pickle.load)
+    if isinstance(tree, ast.Module):
+        return tree
+    tree = _ast_parse(source)
+    _disk_cache_store(path, lambda t, f: pickle.dump(t, f, protocol=pickle.HIGHEST_PROTOCOL), tree)
+    return tree
+
+def _source_key(source):
+    source = source or ""
+    return (hash_source(source), len(source))
+
+def _parse_cached(source):
+    """
+    Parse source once per run. Keyed on a short blake2b digest + length so the
+    cache holds trees, not full copies of every source revision it has seen.
+    """
+    key = _source_key(source)
+    tree = _parse_cache.get(key)
+    if tree is None:
+        tree = load_or_parse(source or "")
+        _parse_cache[key] = tree
+    return tree
 
-    Strategy:
-    - start_line includes decorators
-    - end_line prefers "next sibling lineno - 1" (prevents wiping inserted methods)
-    - falls back to node.end_lineno for last sibling
+def _probe_end_lineno():
+    fn = ast.parse("def f():\n    return 1\n").body[0]
+    return getattr(fn, "end_lineno", None) is not None
+
+# Fixed per interpreter, so probed once at import.
+_SUPPORTS_END_LINENO = _probe_end_lineno()
+
+def supports_end_lineno():
+    return _SUPPORTS_END_LINENO
+
+def _node_start_line(node):
+    # start_line includes decorators
+    start_line = node.lineno
+    for d in getattr(node, "decorator_list", []) or []:
+        dl = getattr(d, "lineno", None)
+        if dl is not None:
+            start_line = min(start_line, dl)
+    return start_line
+
+def _def_ranges(items):
     """
-    tree = ast.parse(source)
-    matches = []
+    Yield (node, start_line, end_line) for every FunctionDef / AsyncFunctionDef in items.
 
-    for node in tree.body:
-        if not (isinstance(node, ast.ClassDef) and node.name == class_name):
+    end_line prefers "next sibling lineno - 1" (prevents wiping inserted methods)
+    and falls back to node.end_lineno for the last sibling. Callers check
+    _SUPPORTS_END_LINENO first.
+    """
+    items = [it for it in items if getattr(it, "lineno", None) is not None]
+    for idx, it in enumerate(items):
+        if not isinstance(it, (ast.FunctionDef, ast.AsyncFunctionDef)):
             continue
+        start_line = _node_start_line(it)
+        end_line = it.end_lineno
+        if idx + 1 < len(items):
+            next_line = getattr(items[idx + 1], "lineno", None)
+            if next_line is not None and next_line > start_line:
+                end_line = next_line - 1
+        yield it, start_line, end_line
 
-        items = [it for it in node.body if getattr(it, "lineno", None) is not None]
+def _assign_ranges(items):
+    """
+    Yield (name, start_line, end_line) for every NAME = ... / NAME: T = ... in items.
+    Multi-line RHS is covered via end_lineno.
+    """
+    for it in items:
+        if getattr(it, "lineno", None) is None:
+            continue
+        if isinstance(it, ast.Assign):
+            names = []
+            for t in (it.targets or []):
+                if isinstance(t, ast.Name) and t.id not in names:
+                    names.append(t.id)
+        elif isinstance(it, ast.AnnAssign):
+            t = getattr(it, "target", None)
+            names = [t.id] if isinstance(t, ast.Name) else []
+        else:
+            continue
+        if not names:
+            continue
+        for name in names:
+            yield name, it.lineno, it.end_lineno
 
-        for idx, it in enumerate(items):
-            if not isinstance(it, (ast.FunctionDef, ast.AsyncFunctionDef)):
-                continue
-            if it.name != method_name:
-                continue
+def build_symbol_index(source):
+    """
+    One parse, one walk of tree.body: every patchable target in the file mapped to
+    its 1-based inclusive (start_line, end_line) ranges.
+
+        funcs:      name -> [ranges]                top-level functions
+        classes:    name -> [ranges]                top-level classes
+        methods:    (class, name) -> [ranges]       methods of top-level classes
+        globals:    name -> [ranges]                module-level assignments
+        class_vars: (class, name) -> [ranges]       class-level assignments
+        body_start: def start_line -> first body line (defs whose body
+                    starts below the header only; see shift_symbol_index)
+
+    More than one range under a key means the target is ambiguous.
+    """
+    key = _source_key(source)
+    index = _index_cache.get(key)
+    if index is not None:
+        return index
 
-            start_line = it.lineno
-            for d in getattr(it, "decorator_list", []) or []:
-                dl = getattr(d, "lineno", None)
-                if dl is not None:
-                    start_line = min(start_line, dl)
+    if not _SUPPORTS_END_LINENO:
+        raise RuntimeError("end_lineno not available; cannot locate symbol ranges reliably.")
 
-            end_line = getattr(it, "end_lineno", None)
+    tree = _parse_cached(source)
+    index = {"funcs": {}, "classes": {}, "methods": {}, "globals": {}, "class_vars": {},
+             "body_start": {}}
 
-            if idx + 1 < len(items):
-                next_it = items[idx + 1]
-                next_line = getattr(next_it, "lineno", None)
-                if next_line is not None and next_line > start_line:
-                    end_line = next_line - 1
+    def _note_body(node, start_line):
+        first = getattr(node.body[0], "lineno", None) if node.body else None
+        if first is not None and first > node.lineno:
+            index["body_start"][start_line] = first
 
-            if end_line is None:
-                raise RuntimeError("end_lineno not available; cannot locate method end reliably.")
+    for node, start_line, end_line in _def_ranges(tree.body):
+        index["funcs"].setdefault(node.name, []).append((start_line, end_line))
+        _note_body(node, start_line)
+    for name, start_line, end_line in _assign_ranges(tree.body):
+        index["globals"].setdefault(name, []).append((start_line, end_line))
 
-            matches.append((start_line, end_line))
+    for node in tree.body:
+        if not isinstance(node, ast.ClassDef):
+            continue
+        if getattr(node, "lineno", None) is not None:
+            index["classes"].setdefault(node.name, []).append((node.lineno, node.end_lineno))
+        for it, start_line, end_line in _def_ranges(node.body or []):
+            index["methods"].setdefault((node.name, it.name), []).append((start_line, end_line))
+            _note_body(it, start_line)
+        for name, start_line, end_line in _assign_ranges(node.body or []):
+            index["class_vars"].setdefault((node.name, name), []).append((start_line, end_line))
 
-    if not matches:
-        return None
-    if len(matches) > 1:
-        return ("AMBIGUOUS", matches)
-    return matches[0]
+    _index_cache[key] = index
+    return index
 
-def find_class_range(source, class_name):
-    tree = ast.parse(source)
-    matches = []
-    for node in tree.body:
-        if isinstance(node, ast.ClassDef) and node.name == class_name:
-            if getattr(node, "lineno", None) is None:
-                continue
-            if getattr(node, "end_lineno", None) is None:
-                raise RuntimeError("end_lineno not available; cannot locate class end reliably.")
-            matches.append((node.lineno, node.end_lineno))
-    if not matches:
-        return None
-    if len(matches) > 1:
-        return ("AMBIGUOUS", matches)
-    return matches[0]
+_RANGE_KINDS = ("funcs", "classes", "methods", "globals", "class_vars")
 
-def find_function_range(source, func_name):
-    tree = ast.parse(source)
-    matches = []
-    items = [n for n in tree.body if getattr(n, 'lineno', None) is not None]
-    for idx, node in enumerate(items):
-        if not isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef)):
-            continue
-        if node.name != func_name:
-            continue
-        start_line = node.lineno
-        for d in getattr(node, 'decorator_list', []) or []:
-            dl = getattr(d, 'lineno', None)
-            if dl is not None:
-                start_line = min(start_line, dl)
-        end_line = getattr(node, 'end_lineno', None)
-        if idx + 1 < len(items):
-            next_node = items[idx + 1]
-            next_line = getattr(next_node, 'lineno', None)
-            if next_line is not None and next_line > start_line:
-                end_line = next_line - 1
-        if end_line is None:
-            raise RuntimeError('end_lineno not available; cannot locate function end reliably.')
-        matches.append((start_line, end_line))
+def shift_symbol_index(index, after_line, removed, added):
+    """
+    Return a copy of index as it would be after replacing the `removed` lines
+    following after_line with `added` lines, without re-parsing.
+
+    Only valid for edits inside a def body that cannot change the file's
+    top-level / class-level structure (the caller checks that): ranges
+    starting below the edit move, ranges containing it stretch.
+    """
+    delta = added - removed
+    if not delta:
+        return index
+
+    def mv(n):
+        return n + delta if n > after_line else n
+
+    out = {}
+    for kind in _RANGE_KINDS:
+        out[kind] = {}
+        for key, ranges in index[kind].items():
+            moved = []
+            for s, e in ranges:
+                if s > after_line:
+                    moved.append((s + delta, e + delta))
+                elif e >= after_line:
+                    moved.append((s, e + delta))
+                else:
+                    moved.append((s, e))
+            out[kind][key] = moved
+    out["body_start"] = {mv(s): mv(b) for s, b in index["body_start"].items()}
+    return out
+
+def same_symbol_ranges(a, b):
+    return all(a[kind] == b[kind] for kind in _RANGE_KINDS)
+
+def _index_lookup(index, kind, key):
+    matches = index[kind].get(key)
     if not matches:
         return None
     if len(matches) > 1:
-        return ('AMBIGUOUS', matches)
+        return ("AMBIGUOUS", list(matches))
     return matches[0]
 
+def find_method_range(source, class_name, method_name):
+    """
+    Return (start_line, end_line) 1-based inclusive for a method inside a top-level class.
 
-# =========================
-# TEXT APPLY
-# =========================
+    Strategy:
+    - start_line includes decorators
+    - end_line prefers "next sibling lineno - 1" (prevents wiping inserted methods)
+    - falls back to node.end_lineno for last sibling
+    """
+    return _index_lookup(build_symbol_index(source), "methods", (class_name, method_name))
+
+def find_class_range(source, class_name):
+    return _index_lookup(build_symbol_index(source), "classes", class_name)
+
+def find_function_range(source, func_name):
+    return _index_lookup(build_symbol_index(source), "funcs", func_name)
 
 def find_global_assign_range(source, var_name):
     """
@@ -300,36 +598,7 @@ def find_global_assign_range(source, var_name):
     - Supports multi-line RHS via end_lineno
     - If multiple matches exist, returns ("AMBIGUOUS", matches)
     """
-    tree = ast.parse(source)
-    matches = []
-
-    for node in tree.body:
-        if isinstance(node, ast.Assign):
-            for t in (node.targets or []):
-                if isinstance(t, ast.Name) and t.id == var_name:
-                    if getattr(node, "lineno", None) is None:
-                        continue
-                    end_line = getattr(node, "end_lineno", None)
-                    if end_line is None:
-                        raise RuntimeError("end_lineno not available; cannot locate assignment end reliably.")
-                    matches.append((node.lineno, end_line))
-                    break
-
-        elif isinstance(node, ast.AnnAssign):
-            t = getattr(node, "target", None)
-            if isinstance(t, ast.Name) and t.id == var_name:
-                if getattr(node, "lineno", None) is None:
-                    continue
-                end_line = getattr(node, "end_lineno", None)
-                if end_line is None:
-                    raise RuntimeError("end_lineno not available; cannot locate assignment end reliably.")
-                matches.append((node.lineno, end_line))
-
-    if not matches:
-        return None
-    if len(matches) > 1:
-        return ("AMBIGUOUS", matches)
-    return matches[0]
+    return _index_lookup(build_symbol_index(source), "globals", var_name)
 
 def find_class_assign_range(source, class_name, var_name):
     """
@@ -344,102 +613,95 @@ def find_class_assign_range(source, class_name, var_name):
     - Supports multi-line RHS via end_lineno
     - If multiple matches exist, returns ("AMBIGUOUS", matches)
     """
-    tree = ast.parse(source)
-    matches = []
+    return _index_lookup(build_symbol_index(source), "class_vars", (class_name, var_name))
 
-    for node in tree.body:
-        if not (isinstance(node, ast.ClassDef) and node.name == class_name):
-            continue
 
-        for item in (node.body or []):
-            # NAME = ...
-            if isinstance(item, ast.Assign):
-                for t in (item.targets or []):
-                    if isinstance(t, ast.Name) and t.id == var_name:
-                        if getattr(item, "lineno", None) is None:
-                            continue
-                        end_line = getattr(item, "end_lineno", None)
-                        if end_line is None:
-                            raise RuntimeError("end_lineno not available; cannot locate assignment end reliably.")
-                        matches.append((item.lineno, end_line))
-                        break
-
-            # NAME: T = ...
-            elif isinstance(item, ast.AnnAssign):
-                t = getattr(item, "target", None)
-                if isinstance(t, ast.Name) and t.id == var_name:
-                    if getattr(item, "lineno", None) is None:
-                        continue
-                    end_line = getattr(item, "end_lineno", None)
-                    if end_line is None:
-                        raise RuntimeError("end_lineno not available; cannot locate assignment end reliably.")
-                    matches.append((item.lineno, end_line))
+# =========================
+# TEXT APPLY
+# =========================
 
-    if not matches:
-        return None
-    if len(matches) > 1:
-        return ("AMBIGUOUS", matches)
-    return matches[0]
+def _reindent(block, indent):
+    """
+    Dedent block (same common-margin rule as textwrap.dedent) and re-indent it
+    to `indent`, in one split: returns keepends lines, blank lines as '\n'.
+    """
+    src = (block or '').strip('\n').splitlines()
+    if src and src[-1] and not src[-1].strip(' \t'):
+        src.pop()   # dedent() empties a trailing spaces-only line, and splitlines() then drops it
+    margin = None
+    for line in src:
+        if not line.strip():
+            continue
+        ws = get_line_indent(line)
+        if margin is None or not ws.startswith(margin):
+            margin = ws if margin is None else os.path.commonprefix([margin, ws])
+    cut = len(margin or '')
+    return [indent + line[cut:] + '\n' if line.strip() else '\n' for line in src]
 
-def replace_lines(source, start_line, end_line, replacement_block):
-    lines = source.splitlines(True)
+def replace_lines_inplace(lines, start_line, end_line, replacement_block):
+    """
+    Replace lines[start_line-1:end_line] (1-based inclusive, keepends lines) in place.
+    Returns True when the list actually changed.
+    """
     if not lines:
-        return (replacement_block or '').strip('\n') + '\n'
+        lines.extend(((replacement_block or '').strip('\n') + '\n').splitlines(True))
+        return True
 
     if start_line < 1 or end_line < start_line or end_line > len(lines):
         raise ValueError('Invalid line range %d..%d for %d-line source' % (start_line, end_line, len(lines)))
 
-    before = lines[:start_line - 1]
-    after  = lines[end_line:]
-
     indent = get_line_indent(lines[start_line - 1])
-    replacement_block = textwrap.dedent((replacement_block or '').strip('\n'))
-
-    new_lines = []
-    for line in replacement_block.splitlines():
-        if line.strip():
-            new_lines.append(indent + line + '\n')
-        else:
-            new_lines.append('\n')
+    new_lines = _reindent(replacement_block, indent)
 
     # ensure blank line after block if next line is not already blank
-    if after and after[0].strip():
+    if end_line < len(lines) and lines[end_line].strip():
         new_lines.append('\n')
 
-    return ''.join(before) + ''.join(new_lines) + ''.join(after)
+    if lines[start_line - 1:end_line] == new_lines:
+        return False
+    lines[start_line - 1:end_line] = new_lines
+    return True
 
-def insert_after_lines(source, line_no, insert_block, indent, tight=False):
+def insert_after_lines_inplace(lines, line_no, insert_block, indent, tight=False):
     """
-    Insert after line_no (1-based line count in splitlines(True) world: we accept line_no in that space).
+    Insert after line_no (1-based, keepends lines; 0 = top of file) in place.
     If tight=True, do not auto-add blank lines before/after insert block.
+    Returns True when the list actually changed.
     """
-    src_lines = source.splitlines(True)
-
-    if line_no < 0 or line_no > len(src_lines):
-        raise ValueError('Invalid insert position after line %d in %d-line source' % (line_no, len(src_lines)))
-
-    insert_block = textwrap.dedent((insert_block or '').strip('\n'))
-
-    ins_lines = []
-    for line in insert_block.splitlines():
-        if line.strip():
-            ins_lines.append(indent + line + '\n')
-        else:
-            ins_lines.append('\n')
+    if line_no < 0 or line_no > len(lines):
+        raise ValueError('Invalid insert position after line %d in %d-line source' % (line_no, len(lines)))
 
-    before = src_lines[:line_no]
-    after  = src_lines[line_no:]
+    ins_lines = _reindent(insert_block, indent)
 
     if not tight:
-        if before and before[-1].strip():
+        if line_no > 0 and lines[line_no - 1].strip():
             ins_lines.insert(0, '\n')
-        if after and after[0].strip():
+        if line_no < len(lines) and lines[line_no].strip():
             ins_lines.append('\n')
 
-    if src_lines and not src_lines[-1].endswith('\n'):
-        src_lines[-1] = src_lines[-1] + '\n'
+    if not ins_lines:
+        return False
 
-    return ''.join(before) + ''.join(ins_lines) + ''.join(after)
+    # inserting after an unterminated last line must not glue onto it
+    if line_no == len(lines) and line_no > 0 and not lines[-1].endswith('\n'):
+        lines[-1] = lines[-1] + '\n'
+
+    lines[line_no:line_no] = ins_lines
+    return True
+
+def replace_lines(source, start_line, end_line, replacement_block):
+    lines = source.splitlines(True)
+    replace_lines_inplace(lines, start_line, end_line, replacement_block)
+    return ''.join(lines)
+
+def insert_after_lines(source, line_no, insert_block, indent, tight=False):
+    """
+    Insert after line_no (1-based line count in splitlines(True) world: we accept line_no in that space).
+    If tight=True, do not auto-add blank lines before/after insert block.
+    """
+    lines = source.splitlines(True)
+    insert_after_lines_inplace(lines, line_no, insert_block, indent, tight=tight)
+    return ''.join(lines)
 
 def parse_target(raw_target, default_file_abs, op_default_file=None):
     raw_target = (raw_target or '').strip()
@@ -467,154 +729,132 @@ def parse_target(raw_target, default_file_abs, op_default_file=None):
     else:
         return file_ref, None, sym
 
+@lru_cache(maxsize=4096)
+def _parse_target_cached(raw_target, default_file_abs, op_default_file=None):
+    # parse_target is pure and returns a tuple of strings, so repeats of one target share it
+    return parse_target(raw_target, default_file_abs, op_default_file)
+
+# One match per bundle line instead of a startswith() per op keyword.
+# Each keyword must be followed by a space, as with the old prefix checks.
+_OP_HEADER_RE = re.compile(
+    r'(REPLACE_LINES|REPLACE_LINE|REPLACE_EXPR|REPLACE|INSERT_AFTER|INSERT_BEFORE|'
+    r'INSERT_INTO|APPEND_INTO|PREPEND_INTO|LIST_TARGETS) (.*)$')
+# A body runs until the next op header or DEFAULT_FILE line. One unanchored-end match
+# on the raw line stands in for strip() + _OP_HEADER_RE / startswith('DEFAULT_FILE ').
+_BODY_END_RE = re.compile(
+    r'\s*(?:REPLACE_LINES|REPLACE_LINE|REPLACE_EXPR|REPLACE|INSERT_AFTER|INSERT_BEFORE|'
+    r'INSERT_INTO|APPEND_INTO|PREPEND_INTO|LIST_TARGETS|DEFAULT_FILE) .*\S')
+
+# Directive lines: one C-level startswith(tuple) test, then KEY:value via partition()
+_DIRECTIVE_PREFIXES = ('ANCHOR_START:', 'ANCHOR_END:', 'ANCHOR:', 'EXPECT:', 'OCCURRENCE:',
+                       'MATCH:', 'INDENT:', 'POSITION:', 'OLD:', 'NEW:')
+
+def _directive_int(val):
+    try:
+        return int(val)
+    except ValueError:
+        return 1
+
+_DIRECTIVE_CONVERT = {
+    'EXPECT': _directive_int,
+    'OCCURRENCE': _directive_int,
+    'MATCH': str.lower,
+    'INDENT': str.lower,
+    'POSITION': str.lower,
+}
+
 def parse_patch_bundle(text):
     if not text or not text.strip():
         return [], None
 
     lines = text.splitlines()
+    n = len(lines)
     ops = []
     i = 0
     bundle_default_file = None
 
-    def is_op_header(line):
-        s = line.strip()
-        return (s.startswith('REPLACE ') or
-                s.startswith('REPLACE_LINE ') or
-                s.startswith('REPLACE_LINES ') or
-                s.startswith('REPLACE_EXPR ') or
-                s.startswith('INSERT_AFTER ') or
-                s.startswith('INSERT_BEFORE ') or
-                s.startswith('INSERT_INTO ') or
-                s.startswith('APPEND_INTO ') or
-                s.startswith('PREPEND_INTO ') or
-                s.startswith('LIST_TARGETS '))
-
-    def is_default_file(line):
-        return line.strip().startswith('DEFAULT_FILE ')
-
-    def first_sig(body):
-        for ln in (body or '').splitlines():
-            if ln.strip():
-                return ln.strip()
+    def first_sig(body_lines):
+        # first non-blank body line, found without joining / re-splitting the body
+        for ln in body_lines:
+            s = ln.strip()
+            if s:
+                return s
         return ''
 
     def parse_line_op_body(body_lines):
-        anchor = None
-        anchor_start = None
-        anchor_end = None
-        expect = 1
-        occurrence = 1
-        match_mode = 'exact'
-        indent_mode = 'auto'
-        position = 'after'
-        old_expr = None
-        new_expr = None
-        code_lines = []
-        in_code = False
-        for ln in body_lines:
-            if not in_code:
-                s = ln.strip()
-                if s.startswith('ANCHOR:'):
-                    anchor = s[len('ANCHOR:'):].strip()
-                elif s.startswith('ANCHOR_START:'):
-                    anchor_start = s[len('ANCHOR_START:'):].strip()
-                elif s.startswith('ANCHOR_END:'):
-                    anchor_end = s[len('ANCHOR_END:'):].strip()
-                elif s.startswith('EXPECT:'):
-                    try:
-                        expect = int(s[len('EXPECT:'):].strip())
-                    except ValueError:
-                        expect = 1
-                elif s.startswith('OCCURRENCE:'):
-                    try:
-                        occurrence = int(s[len('OCCURRENCE:'):].strip())
-                    except ValueError:
-                        occurrence = 1
-                elif s.startswith('MATCH:'):
-                    match_mode = s[len('MATCH:'):].strip().lower()
-                elif s.startswith('INDENT:'):
-                    indent_mode = s[len('INDENT:'):].strip().lower()
-                elif s.startswith('POSITION:'):
-                    position = s[len('POSITION:'):].strip().lower()
-                elif s.startswith('OLD:'):
-                    old_expr = s[len('OLD:'):].strip()
-                elif s.startswith('NEW:'):
-                    new_expr = s[len('NEW:'):].strip()
-                elif s:
-                    in_code = True
-                    code_lines.append(ln)
-            else:
-                code_lines.append(ln)
-        code = '\n'.join(code_lines).rstrip() + '\n' if code_lines else ''
-        return (anchor, anchor_start, anchor_end, expect, occurrence, match_mode,
-                indent_mode, position, old_expr, new_expr, code)
+        vals = {
+            'ANCHOR': None, 'ANCHOR_START': None, 'ANCHOR_END': None,
+            'EXPECT': 1, 'OCCURRENCE': 1,
+            'MATCH': 'exact', 'INDENT': 'auto', 'POSITION': 'after',
+            'OLD': None, 'NEW': None,
+        }
+        # directives come first; everything from the first other non-blank line is code
+        code_at = None
+        for k, ln in enumerate(body_lines):
+            s = ln.strip()
+            if s.startswith(_DIRECTIVE_PREFIXES):
+                key, _, val = s.partition(':')
+                val = val.strip()
+                convert = _DIRECTIVE_CONVERT.get(key)
+                vals[key] = convert(val) if convert else val
+            elif s:
+                code_at = k
+                break
+        return (vals['ANCHOR'], vals['ANCHOR_START'], vals['ANCHOR_END'], vals['EXPECT'],
+                vals['OCCURRENCE'], vals['MATCH'], vals['INDENT'], vals['POSITION'],
+                vals['OLD'], vals['NEW'], code_at)
+
+    # op -> body parser; ops not listed take a plain code body.
+    body_parsers = {
+        'INSERT_INTO': parse_line_op_body,
+        'REPLACE_LINE': parse_line_op_body,
+        'REPLACE_LINES': parse_line_op_body,
+        'REPLACE_EXPR': parse_line_op_body,
+    }
 
-    while i < len(lines):
-        while i < len(lines) and not lines[i].strip():
+    while i < n:
+        while i < n and not lines[i].strip():
             i += 1
-        if i >= len(lines):
+        if i >= n:
             break
 
         line = lines[i].rstrip('\n')
+        s = line.strip()
 
-        if is_default_file(line):
-            bundle_default_file = line.strip()[len('DEFAULT_FILE '):].strip() or None
+        if s.startswith('DEFAULT_FILE '):
+            bundle_default_file = s[len('DEFAULT_FILE '):].strip() or None
             i += 1
             continue
 
-        if not is_op_header(line):
+        m = _OP_HEADER_RE.match(s)
+        if m is None:
             raise ValueError('Patch parse error: expected op header at line ' + str(i+1) + ': ' + repr(line))
 
-        s = line.strip()
-        if s.startswith('REPLACE_LINES '):
-            op = 'REPLACE_LINES'
-            target = s[len('REPLACE_LINES '):].strip()
-        elif s.startswith('REPLACE_LINE '):
-            op = 'REPLACE_LINE'
-            target = s[len('REPLACE_LINE '):].strip()
-        elif s.startswith('REPLACE_EXPR '):
-            op = 'REPLACE_EXPR'
-            target = s[len('REPLACE_EXPR '):].strip()
-        elif s.startswith('REPLACE '):
-            op = 'REPLACE'
-            target = s[len('REPLACE '):].strip()
-        elif s.startswith('INSERT_AFTER '):
-            op = 'INSERT_AFTER'
-            target = s[len('INSERT_AFTER '):].strip()
-        elif s.startswith('INSERT_BEFORE '):
-            op = 'INSERT_BEFORE'
-            target = s[len('INSERT_BEFORE '):].strip()
-        elif s.startswith('INSERT_INTO '):
-            op = 'INSERT_INTO'
-            target = s[len('INSERT_INTO '):].strip()
-        elif s.startswith('APPEND_INTO '):
-            op = 'APPEND_INTO'
-            target = s[len('APPEND_INTO '):].strip()
-        elif s.startswith('PREPEND_INTO '):
-            op = 'PREPEND_INTO'
-            target = s[len('PREPEND_INTO '):].strip()
-        elif s.startswith('LIST_TARGETS '):
-            op = 'LIST_TARGETS'
-            target = s[len('LIST_TARGETS '):].strip()
-        else:
-            op = 'REPLACE'
-            target = s
+        op = m.group(1)
+        target = m.group(2).strip()
 
         i += 1
 
-        body_lines = []
-        while i < len(lines) and not is_op_header(lines[i]) and not is_default_file(lines[i]):
-            body_lines.append(lines[i])
+        body_start = i
+        end_match = _BODY_END_RE.match
+        while i < n and end_match(lines[i]) is None:
             i += 1
+        body_lines = lines[body_start:i]
+        body = '\n'.join(body_lines).rstrip() + '\n' if body_lines else ''
 
-        if op in ('INSERT_INTO', 'REPLACE_LINE', 'REPLACE_LINES', 'REPLACE_EXPR'):
+        parse_body = body_parsers.get(op)
+        if parse_body is not None:
             (anchor, anchor_start, anchor_end, expect, occurrence, match_mode,
-             indent_mode, position, old_expr, new_expr, code) = parse_line_op_body(body_lines)
+             indent_mode, position, old_expr, new_expr, code_at) = parse_body(body_lines)
+            # code is a tail of body (it starts on a non-blank line), so slice it out of
+            # the one join instead of joining the code lines again
+            code = body[sum(map(len, body_lines[:code_at])) + code_at:] if code_at is not None else ''
             ops.append({
                 'op': op,
                 'target': target,
-                'body': '\n'.join(body_lines).rstrip() + '\n' if body_lines else '',
-                'sig': first_sig(code) if code else '',
+                'body': body,
+                # code always starts with its first non-blank line and ends in '\n'
+                'sig': code[:code.find('\n')].strip() if code else '',
                 'default_file': bundle_default_file,
                 'anchor': anchor,
                 'anchor_start': anchor_start,
@@ -629,95 +869,552 @@ def parse_patch_bundle(text):
                 'code': code,
             })
         else:
-            body = '\n'.join(body_lines).rstrip() + '\n' if body_lines else ''
             ops.append({
                 'op': op,
                 'target': target,
                 'body': body,
-                'sig': first_sig(body),
+                'sig': first_sig(body_lines),
                 'default_file': bundle_default_file,
             })
 
     return ops, bundle_default_file
 
+_BUNDLE_CACHE_MAX = 4
+_bundle_cache = {}   # hash_source(bundle) -> parse_patch_bundle() result; oldest evicted first
+
+def parse_patch_bundle_cached(text):
+    """
+    parse_patch_bundle memoized by content hash, so Dry Run then Apply on the same
+    clipboard parses it once. Callers only read the returned ops.
+    """
+    key = hash_source(text)   # memoized: the manifest's bundle_sha reuses it
+    parsed = _bundle_cache.get(key)
+    if parsed is None:
+        if len(_bundle_cache) >= _BUNDLE_CACHE_MAX:
+            _bundle_cache.pop(next(iter(_bundle_cache)), None)
+        parsed = _bundle_cache[key] = parse_patch_bundle(text)
+    return parsed
+
+
+_DEF_SIG_RE = re.compile(r'^\s*def\s+([A-Za-z_]\w*)\s*\(')
+_def_anywhere_res = {}   # def name -> compiled "def NAME(" line pattern
+
+def _first_sig_line(body, fallback_sig=''):
+    s = (fallback_sig or '').strip()
+    if s:
+        return s
+    for ln in (body or '').splitlines():
+        if ln.strip():
+            return ln.strip()
+    return ''
+
+def _def_name_from_sig(sig_line):
+    # first non-blank word must be "def"; anything else is settled without the regex
+    if not (sig_line or '').lstrip().startswith('def'):
+        return None
+    m = _DEF_SIG_RE.match(sig_line)
+    return m.group(1) if m else None
+
+def _has_def_anywhere(src, name):
+    # plain substring test first: most inserts add a name the file doesn't mention yet
+    if name not in src:
+        return False
+    pat = _def_anywhere_res.get(name)
+    if pat is None:
+        pat = _def_anywhere_res[name] = re.compile(r'^\s*def\s+' + re.escape(name) + r'\s*\(', re.M)
+    return pat.search(src) is not None
+
+def missing_directive(op):
+    """Return the FAILED_PARSE message for a line op lacking a required directive, else None."""
+    kind = op.get('op')
+    if kind in ('INSERT_INTO', 'REPLACE_LINE', 'REPLACE_EXPR') and not op.get('anchor'):
+        return kind + ' requires ANCHOR'
+    if kind == 'REPLACE_LINES' and not (op.get('anchor_start') and op.get('anchor_end')):
+        return 'REPLACE_LINES requires ANCHOR_START and ANCHOR_END'
+    if kind == 'REPLACE_EXPR' and (op.get('old_expr') is None or op.get('new_expr') is None):
+        return 'REPLACE_EXPR requires OLD and NEW'
+    return None
+
 
 # =========================
 # APPLY OPS
 # =========================
-def apply_ops(ops, project_root, default_file_abs):
-    import re
+def apply_ops(ops, project_root, default_file_abs, carry_index=True):
+    """
+    Apply ops in order, in memory. Returns (results, touched_files, file_cache).
+
+    With carry_index, edits confined to a def body shift the file's symbol index
+    instead of forcing a re-parse on the next op. Carried indexes are checked
+    against a fresh parse once at the end; on any mismatch the whole run is
+    redone with carry_index=False.
+    """
 
     results = []
     touched_files = {}   # file_abs -> meta
     file_cache = {}      # file_abs -> in-memory updated source
+    file_lines = {}      # file_abs -> keepends line list, kept in sync with file_cache
+    file_norm = {}       # file_abs -> normalize_ws() of each line, built on first fuzzy match
+    file_index = {}      # file_abs -> symbol index of the current source (None = stale)
+    carried = {}         # file_abs -> True while file_index[file_abs] came from shifting
+    to_verify = []       # (source, carried index) pairs checked after the loop
 
     root_abs = os.path.abspath(project_root)
-
-    for op in ops:
-        results.append({
-            'op': op.get('op'),
-            'target': op.get('target'),
-            'status': None,
-            'file': None,
-            'range': None,
-            'hash_before': None,
-            'hash_after': None,
-            'compile_ok': None,
-            'message': '',
-            'sig': op.get('sig', '')
-        })
-
-    def _first_sig_line(body, fallback_sig=''):
-        s = (fallback_sig or '').strip()
-        if s:
-            return s
-        for ln in (body or '').splitlines():
-            if ln.strip():
-                return ln.strip()
-        return ''
-
-    def _def_name_from_sig(sig_line):
-        m = re.match(r'^\s*def\s+([A-Za-z_]\w*)\s*\(', sig_line or '')
-        return m.group(1) if m else None
-
-    def _has_def_anywhere(src, name):
-        pat = r'^\s*def\s+' + re.escape(name) + r'\s*\('
-        return re.search(pat, src, flags=re.M) is not None
-
-    def _locate(src, class_name, method_name):
+    _parse_cache.clear()
+    _index_cache.clear()
+
+    sig_seen = {}   # file_abs -> (source, {sig_line: present?}) for that exact source
+
+    def _src_has(file_abs, src, needle):
+        """
+        `needle in src`, remembered until the file's source changes, so ops
+        re-checking one signature against an unchanged file scan it once.
+        """
+        memo = sig_seen.get(file_abs)
+        if memo is None or memo[0] is not src:
+            memo = sig_seen[file_abs] = (src, {})
+        hit = memo[1].get(needle)
+        if hit is None:
+            hit = memo[1][needle] = needle in src
+        return hit
+
+    def _locate(index, class_name, method_name):
         # Whole-class target support: Class.*  (e.g. file.py::MyClass.*)
         if class_name is not None and method_name == '*':
-            return find_class_range(src, class_name)
+            return _index_lookup(index, 'classes', class_name)
 
         # Class/module assignment support via @NAME
         if class_name is not None and isinstance(method_name, str) and method_name.startswith('@'):
-            return find_class_assign_range(src, class_name, method_name[1:])
+            return _index_lookup(index, 'class_vars', (class_name, method_name[1:]))
         if class_name is None and isinstance(method_name, str) and method_name.startswith('@'):
-            return find_global_assign_range(src, method_name[1:])
+            return _index_lookup(index, 'globals', method_name[1:])
 
         # Function vs method
         if class_name is None:
-            return find_function_range(src, method_name)
-        return find_method_range(src, class_name, method_name)
-
-    def _find_anchor_hits(src_lines, block_start, block_end, anchor, match_mode='exact'):
-        anchor_cmp = ' '.join(anchor.split()) if match_mode == 'fuzzy' else anchor
-        hits = []
-        for i, line in enumerate(src_lines[block_start - 1:block_end]):
-            line_cmp = ' '.join(line.split()) if match_mode == 'fuzzy' else line
-            if anchor_cmp in line_cmp:
-                hits.append((block_start + i, line))
+            return _index_lookup(index, 'funcs', method_name)
+        return _index_lookup(index, 'methods', (class_name, method_name))
+
+    def _find_anchors_hits(file_abs, block_start, block_end, anchors, match_mode='exact'):
+        """
+        One sweep over the block for several anchors at once.
+        Returns one [(line_no, line_text), ...] list per anchor.
+        """
+        lines = file_lines[file_abs]
+        if match_mode == 'fuzzy':
+            view = file_norm.get(file_abs)
+            if view is None:
+                view = file_norm[file_abs] = list(map(normalize_ws, lines))
+            needles = list(map(normalize_ws, anchors))
+        else:
+            view = lines
+            needles = list(anchors)
+        hits = [[] for _ in needles]
+        block = view[block_start - 1:block_end]
+        if not all(n.splitlines() == [n] for n in needles):
+            # empty or multi-line needle: per-line containment is the definition
+            for i, line_cmp in enumerate(block, block_start):
+                for k, needle in enumerate(needles):
+                    if needle in line_cmp:
+                        hits[k].append((i, lines[i - 1].rstrip('\n')))
+            return hits
+
+        # str.find over the joined block, line number via bisect on cumulative line ends.
+        # Keepends lines join as-is; normalized lines have no terminator, so add one.
+        if match_mode == 'fuzzy':
+            text = '\n'.join(block) + '\n'
+            ends = list(accumulate(map((1).__add__, map(len, block))))
+        else:
+            text = ''.join(block)
+            ends = list(accumulate(map(len, block)))
+        for k, needle in enumerate(needles):
+            pos = text.find(needle)
+            while pos != -1:
+                j = bisect_right(ends, pos)
+                i = block_start + j
+                hits[k].append((i, lines[i - 1].rstrip('\n')))
+                pos = text.find(needle, ends[j])   # one hit per line: resume at the next line
         return hits
 
+    def _find_anchor_hits(file_abs, block_start, block_end, anchor, match_mode='exact'):
+        return _find_anchors_hits(file_abs, block_start, block_end, (anchor,), match_mode)[0]
+
+    def _block_hash(lines, start_line, end_line):
+        # hash of a target block's text, EOL-agnostic; the hash_before convention
+        return hash_text('\n'.join(map(strip_eol, lines[start_line - 1:end_line])) + '\n')
+
+    def _commit_edit(file_abs, rec, prev_src, edit, interior=False, block=None):
+        """
+        file_lines[file_abs] was edited in place: edit = (after_line, removed, added).
+        Refresh the joined source and the per-line caches; interior=True means
+        the edit is confined to a def body, so the symbol index can be shifted.
+        block=(start, end) hashes just that edited block for hash_after, not the file;
+        rec['hash_scope'] says which of the two hash_after covers.
+        """
+        lines = file_lines[file_abs]
+        patched = ''.join(lines)
+        file_cache[file_abs] = patched
+        rec['status'] = 'APPLIED'
+        if block is None:
+            rec['hash_after'] = hash_source(patched)
+            rec['hash_scope'] = 'file'
+        else:
+            rec['hash_after'] = _block_hash(lines, *block)
+
+        after_line, removed, added = edit
+        norm = file_norm.get(file_abs)
+        if norm is not None:
+            norm[after_line:after_line + removed] = map(
+                normalize_ws, lines[after_line:after_line + added])
+
+        index = file_index.get(file_abs)
+        if carry_index and interior and index is not None:
+            file_index[file_abs] = shift_symbol_index(index, *edit)
+            carried[file_abs] = True
+            return
+        if carried.get(file_abs):
+            to_verify.append((prev_src, index))
+        file_index[file_abs] = None
+        carried[file_abs] = False
+
+    def _is_interior(file_abs, start_line, end_line, edit, new_indent):
+        """
+        True if edit = (after_line, removed, added) sits below the def header of
+        the target at start_line, inside its range, and is indented deeper than
+        the def itself.
+        """
+        after_line, removed, added = edit
+        index = file_index.get(file_abs)
+        body_start = index['body_start'].get(start_line) if index else None
+        if body_start is None:
+            return False
+        if after_line < body_start - 1 or after_line + removed > end_line:
+            return False
+        lines = file_lines[file_abs]
+        def_indent = get_line_indent(lines[start_line - 1])
+        if len(new_indent) <= len(def_indent):
+            return False
+        # The rest of the file parsed before, so the file still parses iff the
+        # edited def does on its own. Checking that keeps a carried index from
+        # outliving a broken source (which a full re-parse would report).
+        region = lines[start_line - 1:end_line - removed + added]
+        if any(ln.strip() and not ln.startswith(def_indent) for ln in region):
+            return False
+        try:
+            _ast_parse(''.join(ln[len(def_indent):] for ln in region))
+        except SyntaxError:
+            return False
+        return True
+
+    resolved = {}   # file_ref -> (file_abs, file_rel, status, message)
+
+    def _resolve_file(file_ref):
+        """
+        Resolve and check a target's file once per file_ref; later ops on the
+        same file reuse it (apply_ops never creates or deletes files).
+        """
+        hit = resolved.get(file_ref)
+        if hit is None:
+            # join keeps an absolute file_ref as is; realpath needs no extra abspath
+            file_abs = os.path.realpath(os.path.join(root_abs, file_ref))
+            if not (file_abs == root_abs or file_abs.startswith(root_abs + os.sep)):
+                hit = (file_abs, None, 'FAILED_INVALID_PATH', 'Target file escapes project root')
+            elif not os.path.isfile(file_abs):
+                hit = (file_abs, None, 'FAILED_IO', 'File not found: ' + file_abs)
+            else:
+                hit = (file_abs, os.path.relpath(file_abs, project_root), None, None)
+            resolved[file_ref] = hit
+        return hit
+
     def _anchor_mismatch_msg(anchor, hits_count, expect, src_lines, start_line, end_line):
         block_lines = src_lines[start_line - 1 : min(start_line + 7, end_line)]
-        excerpt = '\n'.join('  ' + l for l in block_lines)
+        excerpt = '\n'.join('  ' + strip_eol(l) for l in block_lines)
         return ('ANCHOR %r matched %d times, expected %d.\nBlock starts:\n%s'
                 % (anchor, hits_count, expect, excerpt))
 
-    for idx, op in enumerate(ops):
-        rec = results[idx]
+    # Op handlers. Each gets the located target (start_line..end_line) in the file's
+    # current line list, edits it in place and records the outcome on rec.
+    def _op_replace(op_kind, op, rec, file_abs, src, lines, start_line, end_line):
+        n_before = len(lines)
+        if not replace_lines_inplace(lines, start_line, end_line, op.get('body')):
+            rec['status'] = 'SKIPPED_ALREADY_APPLIED'
+            rec['hash_after'] = rec['hash_before']
+            return
+        removed = end_line - start_line + 1
+        _commit_edit(file_abs, rec, src, (start_line - 1, removed, removed + len(lines) - n_before))
+
+    def _op_insert_sibling(op_kind, op, rec, file_abs, src, lines, start_line, end_line):
+        if op_kind == 'INSERT_AFTER':
+            insert_line = end_line
+            ref_line = lines[start_line - 1]
+        else:
+            insert_line = start_line - 1
+            ref_line = lines[start_line - 1]
+
+        indent = get_line_indent(ref_line)
+
+        sig_line = _first_sig_line(op.get('body'), op.get('sig'))
+        def_name = _def_name_from_sig(sig_line)
+
+        if def_name and _has_def_anywhere(src, def_name):
+            rec['status'] = 'SKIPPED_ALREADY_PRESENT'
+            rec['hash_after'] = rec['hash_before']
+            return
+        if (not def_name) and sig_line and _src_has(file_abs, src, sig_line):
+            rec['status'] = 'SKIPPED_ALREADY_PRESENT'
+            rec['hash_after'] = rec['hash_before']
+            return
+
+        n_before = len(lines)
+        if not insert_after_lines_inplace(lines, insert_line, op.get('body'), indent, tight=False):
+            rec['status'] = 'SKIPPED_ALREADY_PRESENT'
+            rec['hash_after'] = rec['hash_before']
+            return
+
+        _commit_edit(file_abs, rec, src, (insert_line, 0, len(lines) - n_before))
+
+    def _op_insert_into(op_kind, op, rec, file_abs, src, lines, start_line, end_line):
+        anchor = op.get('anchor')
+        expect = op.get('expect', 1)
+        occurrence = op.get('occurrence', 1)
+        match_mode = op.get('match_mode', 'exact')
+        indent_mode = op.get('indent_mode', 'auto')
+        position = op.get('position', 'after')
+        code = op.get('code', '')
+
+        hits = _find_anchor_hits(file_abs, start_line, end_line, anchor, match_mode)
+        if len(hits) != expect:
+            rec['status'] = 'SKIPPED_ANCHOR_MISMATCH'
+            rec['message'] = _anchor_mismatch_msg(anchor, len(hits), expect, lines, start_line, end_line)
+            return
+
+        if occurrence < 1 or occurrence > len(hits):
+            rec['status'] = 'FAILED_PARSE'
+            rec['message'] = 'OCCURRENCE %d out of range (1..%d)' % (occurrence, len(hits))
+            return
+
+        anchor_lineno, anchor_line_text = hits[occurrence - 1]
+        anchor_indent = get_line_indent(anchor_line_text)
+
+        if indent_mode == 'same':
+            insert_indent = anchor_indent
+        elif indent_mode == 'child':
+            opens_block = anchor_line_text.rstrip().endswith(':')
+            anchor_width = len(anchor_indent)
+            has_deeper = any(
+                indent_width(bl) > anchor_width and bl.strip()
+                for bl in lines[anchor_lineno:end_line]
+            )
+            if not opens_block and not has_deeper:
+                rec['status'] = 'FAILED_PARSE'
+                rec['message'] = 'INDENT: child refused - anchor does not open a block'
+                return
+            insert_indent = anchor_indent + '    '
+        else:
+            if anchor_line_text.rstrip().endswith(':'):
+                insert_indent = anchor_indent + '    '
+            else:
+                insert_indent = anchor_indent
+
+        sig_line = (op.get('sig') or '').strip()
+        if sig_line and _src_has(file_abs, src, sig_line):
+            rec['status'] = 'SKIPPED_ALREADY_PRESENT'
+            rec['hash_after'] = rec['hash_before']
+            return
+
+        if position == 'before':
+            insert_line = anchor_lineno - 1
+        else:
+            insert_line = anchor_lineno
+
+        n_before = len(lines)
+        if not insert_after_lines_inplace(lines, insert_line, code, insert_indent, tight=True):
+            rec['status'] = 'SKIPPED_ALREADY_PRESENT'
+            rec['hash_after'] = rec['hash_before']
+            return
+
+        edit = (insert_line, 0, len(lines) - n_before)
+        _commit_edit(file_abs, rec, src, edit,
+                     _is_interior(file_abs, start_line, end_line, edit, insert_indent))
+
+    def _op_replace_line(op_kind, op, rec, file_abs, src, lines, start_line, end_line):
+        anchor = op.get('anchor')
+        expect = op.get('expect', 1)
+        occurrence = op.get('occurrence', 1)
+        match_mode = op.get('match_mode', 'exact')
+        code = (op.get('code', '') or '').strip()
+
+        hits = _find_anchor_hits(file_abs, start_line, end_line, anchor, match_mode)
+
+        if len(hits) != expect:
+            rec['status'] = 'SKIPPED_ANCHOR_MISMATCH'
+            rec['message'] = _anchor_mismatch_msg(anchor, len(hits), expect, lines, start_line, end_line)
+            return
+
+        if occurrence < 1 or occurrence > len(hits):
+            rec['status'] = 'FAILED_PARSE'
+            rec['message'] = 'OCCURRENCE %d out of range (1..%d)' % (occurrence, len(hits))
+            return
+
+        anchor_lineno, anchor_line_text = hits[occurrence - 1]
+        line_indent = get_line_indent(anchor_line_text)
+        new_line = line_indent + code + '\n'
+
+        if new_line.rstrip() == anchor_line_text.rstrip():
+            rec['status'] = 'SKIPPED_ALREADY_APPLIED'
+            rec['hash_after'] = rec['hash_before']
+            return
+
+        # a multi-line CODE body must stay one list entry per line
+        new_lines = new_line.splitlines(True)
+        lines[anchor_lineno - 1:anchor_lineno] = new_lines
+        edit = (anchor_lineno - 1, 1, len(new_lines))
+        _commit_edit(file_abs, rec, src, edit,
+                     _is_interior(file_abs, start_line, end_line, edit, line_indent),
+                     block=(start_line, end_line + len(new_lines) - 1))
+
+    def _op_replace_lines(op_kind, op, rec, file_abs, src, lines, start_line, end_line):
+        anchor_start = op.get('anchor_start')
+        anchor_end = op.get('anchor_end')
+        match_mode = op.get('match_mode', 'exact')
+        code = op.get('code', '')
+
+        hits_s, hits_e = _find_anchors_hits(file_abs, start_line, end_line,
+                                            (anchor_start, anchor_end), match_mode)
+
+        if len(hits_s) != 1:
+            rec['status'] = 'SKIPPED_ANCHOR_MISMATCH'
+            rec['message'] = 'ANCHOR_START %r matched %d times, expected 1' % (anchor_start, len(hits_s))
+            return
+        if len(hits_e) != 1:
+            rec['status'] = 'SKIPPED_ANCHOR_MISMATCH'
+            rec['message'] = 'ANCHOR_END %r matched %d times, expected 1' % (anchor_end, len(hits_e))
+            return
+
+        line_s, _ = hits_s[0]
+        line_e, _ = hits_e[0]
+        if line_e < line_s:
+            rec['status'] = 'FAILED_PARSE'
+            rec['message'] = 'ANCHOR_END appears before ANCHOR_START in source'
+            return
+
+        n_before = len(lines)
+        block_indent = get_line_indent(lines[line_s - 1])
+        if not replace_lines_inplace(lines, line_s, line_e, code):
+            rec['status'] = 'SKIPPED_ALREADY_APPLIED'
+            rec['hash_after'] = rec['hash_before']
+            return
+        removed = line_e - line_s + 1
+        edit = (line_s - 1, removed, removed + len(lines) - n_before)
+        # a def's last line may also be its end_lineno, which the shift can't track
+        interior = line_e < end_line and _is_interior(file_abs, start_line, end_line, edit, block_indent)
+        _commit_edit(file_abs, rec, src, edit, interior)
+
+    def _op_append_prepend(op_kind, op, rec, file_abs, src, lines, start_line, end_line):
+        code = op.get('body', '')
+
+        if op_kind == 'PREPEND_INTO':
+            # Insert right after the def/class header line
+            ref_line = lines[start_line - 1] if lines else ''
+            insert_indent = get_line_indent(ref_line) + '    '
+            insert_pos = start_line
+        else:
+            # Find last non-blank line in block (scanning up from its end), insert after it
+            block_end = min(end_line, len(lines))
+            last = block_end   # all-blank block: after its final line
+            for i in range(block_end, start_line - 1, -1):
+                if lines[i - 1].strip():
+                    last = i
+                    break
+            if last >= start_line:
+                ref_line = lines[last - 1]
+            else:
+                ref_line = ''
+                last = start_line - 1
+            insert_indent = get_line_indent(ref_line)
+            insert_pos = last
+
+        sig_line = (op.get('sig') or '').strip()
+        if sig_line and _src_has(file_abs, src, sig_line):
+            rec['status'] = 'SKIPPED_ALREADY_PRESENT'
+            rec['hash_after'] = rec['hash_before']
+            return
+
+        n_before = len(lines)
+        if not insert_after_lines_inplace(lines, insert_pos, code, insert_indent, tight=True):
+            rec['status'] = 'SKIPPED_ALREADY_PRESENT'
+            rec['hash_after'] = rec['hash_before']
+            return
+        edit = (insert_pos, 0, len(lines) - n_before)
+        _commit_edit(file_abs, rec, src, edit,
+                     _is_interior(file_abs, start_line, end_line, edit, insert_indent))
+
+    def _op_replace_expr(op_kind, op, rec, file_abs, src, lines, start_line, end_line):
+        anchor = op.get('anchor')
+        expect = op.get('expect', 1)
+        occurrence = op.get('occurrence', 1)
+        match_mode = op.get('match_mode', 'exact')
+        old_expr = op.get('old_expr')
+        new_expr = op.get('new_expr')
+
+        hits = _find_anchor_hits(file_abs, start_line, end_line, anchor, match_mode)
+
+        if len(hits) != expect:
+            rec['status'] = 'SKIPPED_ANCHOR_MISMATCH'
+            rec['message'] = _anchor_mismatch_msg(anchor, len(hits), expect, lines, start_line, end_line)
+            return
+        if occurrence < 1 or occurrence > len(hits):
+            rec['status'] = 'FAILED_PARSE'
+            rec['message'] = 'OCCURRENCE %d out of range (1..%d)' % (occurrence, len(hits))
+            return
+
+        anchor_lineno, anchor_line_text = hits[occurrence - 1]
+        if old_expr not in anchor_line_text:
+            rec['status'] = 'SKIPPED_ANCHOR_MISMATCH'
+            rec['message'] = 'OLD %r not found in anchor line: %r' % (old_expr, anchor_line_text.strip())
+            return
+
+        new_line_text = anchor_line_text.replace(old_expr, new_expr, 1)
+        if new_line_text == anchor_line_text:
+            rec['status'] = 'SKIPPED_ALREADY_APPLIED'
+            rec['hash_after'] = rec['hash_before']
+            return
+
+        if not new_line_text.endswith('\n'):
+            new_line_text += '\n'
+        new_lines = new_line_text.splitlines(True)
+        lines[anchor_lineno - 1:anchor_lineno] = new_lines
+        edit = (anchor_lineno - 1, 1, len(new_lines))
+        _commit_edit(file_abs, rec, src, edit,
+                     _is_interior(file_abs, start_line, end_line, edit, get_line_indent(new_line_text)))
+
+    # op kind -> handler
+    op_handlers = {
+        'REPLACE': _op_replace,
+        'INSERT_AFTER': _op_insert_sibling,
+        'INSERT_BEFORE': _op_insert_sibling,
+        'INSERT_INTO': _op_insert_into,
+        'REPLACE_LINE': _op_replace_line,
+        'REPLACE_LINES': _op_replace_lines,
+        'APPEND_INTO': _op_append_prepend,
+        'PREPEND_INTO': _op_append_prepend,
+        'REPLACE_EXPR': _op_replace_expr,
+    }
+
+    for op in ops:
         op_kind = op.get('op')
+        rec = {
+            'op': op_kind,
+            'target': op.get('target'),
+            'status': None,
+            'file': None,
+            'range': None,
+            'hash_before': None,
+            'hash_after': None,
+            'hash_scope': 'block',   # hash_after covers the target block, or 'file'
+            'compile_ok': None,
+            'message': '',
+            'sig': op.get('sig', '')
+        }
+        results.append(rec)
         try:
             # LIST_TARGETS is a meta-op: only needs a file path, no class/method
             if op_kind == 'LIST_TARGETS':
@@ -726,57 +1423,57 @@ def apply_ops(ops, project_root, default_file_abs):
                     file_ref = target_raw.split('::', 1)[0].strip()
                 else:
                     file_ref = target_raw or default_file_abs
-                file_abs = os.path.realpath(os.path.abspath(
-                    file_ref if os.path.isabs(file_ref)
-                    else os.path.join(project_root, file_ref)
-                ))
-                if not (file_abs == root_abs or file_abs.startswith(root_abs + os.sep)):
-                    rec['status'] = 'FAILED_INVALID_PATH'
-                    rec['message'] = 'Target file escapes project root'
+                file_abs, file_rel, status, message = _resolve_file(file_ref)
+                if status:
+                    rec['status'] = status
+                    rec['message'] = message
                     continue
-                if not os.path.isfile(file_abs):
-                    rec['status'] = 'FAILED_IO'
-                    rec['message'] = 'File not found: ' + file_abs
-                    continue
-                rec['file'] = os.path.relpath(file_abs, project_root)
-                src = file_cache.get(file_abs) or read_text(file_abs)
+                rec['file'] = file_rel
+                src = file_cache.get(file_abs) or read_text_cached(file_abs)
                 try:
-                    tree = ast.parse(src)
+                    tree = _parse_cached(src)
                 except SyntaxError as e:
                     rec['status'] = 'FAILED_PARSE'
                     rec['message'] = 'SyntaxError: ' + str(e)
                     continue
-                file_rel = rec['file']
+                prefix = rec['file'] + '::'
                 targets_found = []
+                append = targets_found.append
+                # parse() yields exact node types, so `type(x) is T` stands in for isinstance
+                def_types = (ast.FunctionDef, ast.AsyncFunctionDef)
                 for node in tree.body:
-                    if isinstance(node, ast.ClassDef):
-                        targets_found.append(file_rel + '::' + node.name + '.*')
+                    t = type(node)
+                    if t in def_types:
+                        append(f"{prefix}{node.name}")
+                    elif t is ast.ClassDef:
+                        cls = f"{prefix}{node.name}."
+                        append(cls + '*')
                         for item in node.body:
-                            if isinstance(item, (ast.FunctionDef, ast.AsyncFunctionDef)):
-                                targets_found.append(file_rel + '::' + node.name + '.' + item.name)
-                            elif isinstance(item, ast.Assign):
-                                for t in (item.targets or []):
-                                    if isinstance(t, ast.Name):
-                                        targets_found.append(file_rel + '::' + node.name + '.@' + t.id)
-                            elif isinstance(item, ast.AnnAssign):
-                                t = getattr(item, 'target', None)
-                                if isinstance(t, ast.Name):
-                                    targets_found.append(file_rel + '::' + node.name + '.@' + t.id)
-                    elif isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef)):
-                        targets_found.append(file_rel + '::' + node.name)
-                    elif isinstance(node, ast.Assign):
-                        for t in (node.targets or []):
-                            if isinstance(t, ast.Name):
-                                targets_found.append(file_rel + '::@' + t.id)
-                    elif isinstance(node, ast.AnnAssign):
-                        t = getattr(node, 'target', None)
-                        if isinstance(t, ast.Name):
-                            targets_found.append(file_rel + '::@' + t.id)
+                            it = type(item)
+                            if it in def_types:
+                                append(cls + item.name)
+                            elif it is ast.Assign:
+                                for tgt in (item.targets or []):
+                                    if type(tgt) is ast.Name:
+                                        append(f"{cls}@{tgt.id}")
+                            elif it is ast.AnnAssign:
+                                tgt = getattr(item, 'target', None)
+                                if type(tgt) is ast.Name:
+                                    append(f"{cls}@{tgt.id}")
+                    elif t is ast.Assign:
+                        for tgt in (node.targets or []):
+                            if type(tgt) is ast.Name:
+                                append(f"{prefix}@{tgt.id}")
+                    elif t is ast.AnnAssign:
+                        tgt = getattr(node, 'target', None)
+                        if type(tgt) is ast.Name:
+                            append(f"{prefix}@{tgt.id}")
                 targets_str = '\n'.join(targets_found)
                 rec['status'] = 'APPLIED'
                 rec['message'] = 'Targets found: %d' % len(targets_found)
-                rec['hash_before'] = sha256_text(src)
+                rec['hash_before'] = hash_source(src)
                 rec['hash_after'] = rec['hash_before']
+                rec['hash_scope'] = 'file'
                 if clipboard is not None:
                     try:
                         clipboard.set(targets_str)
@@ -784,43 +1481,51 @@ def apply_ops(ops, project_root, default_file_abs):
                         pass
                 continue
 
-            file_ref, class_name, method_name = parse_target(
+            file_ref, class_name, method_name = _parse_target_cached(
                 op.get('target'),
                 default_file_abs,
                 op_default_file=op.get('default_file')
             )
 
-            file_abs = os.path.realpath(os.path.abspath(
-                file_ref if os.path.isabs(file_ref)
-                else os.path.join(project_root, file_ref)
-            ))
-
-            if not (file_abs == root_abs or file_abs.startswith(root_abs + os.sep)):
-                rec['status'] = 'FAILED_INVALID_PATH'
-                rec['message'] = 'Target file escapes project root'
+            file_abs, file_rel, status, message = _resolve_file(file_ref)
+            if status:
+                rec['status'] = status
+                rec['message'] = message
                 continue
 
-            if not os.path.isfile(file_abs):
-                rec['status'] = 'FAILED_IO'
-                rec['message'] = 'File not found: ' + file_abs
-                continue
+            rec['file'] = file_rel
 
-            rec['file'] = os.path.relpath(file_abs, project_root)
+            # Malformed line ops fail here, before the file is read or parsed
+            missing = missing_directive(op)
+            if missing:
+                rec['status'] = 'FAILED_PARSE'
+                rec['message'] = missing
+                continue
 
             src = file_cache.get(file_abs)
             if src is None:
-                src = read_text(file_abs)
+                src = read_text_cached(file_abs)
                 file_cache[file_abs] = src
+                file_lines[file_abs] = src.splitlines(True)
+            lines = file_lines[file_abs]
 
             if file_abs not in touched_files:
                 touched_files[file_abs] = {
+                    'rel': file_rel,
                     'before': src,
+                    # digest taken now, while src is the revision the index lookup keys on;
+                    # later edits can push it out of hash_source's small memo
+                    'before_sha': hash_source(src),
                     'after': None,
                     'compile_ok': None,
                     'compile_error': ''
                 }
 
-            found = _locate(src, class_name, method_name)
+            index = file_index.get(file_abs)
+            if index is None:
+                index = build_symbol_index(src)
+                file_index[file_abs] = index
+            found = _locate(index, class_name, method_name)
             if found is None:
                 rec['status'] = 'FAILED_NOT_FOUND'
                 rec['message'] = 'Target not found: ' + str(class_name) + '.' + str(method_name)
@@ -833,297 +1538,32 @@ def apply_ops(ops, project_root, default_file_abs):
             start_line, end_line = found
             rec['range'] = [start_line, end_line]
 
-            src_lines = src.splitlines()
-            before_block = '\n'.join(src_lines[start_line - 1:end_line]) + '\n'
-            rec['hash_before'] = sha256_text(before_block)
+            rec['hash_before'] = _block_hash(lines, start_line, end_line)
 
             op_kind = op.get('op')
-
-            if op_kind == 'REPLACE':
-                patched = replace_lines(src, start_line, end_line, op.get('body'))
-                if sha256_text(patched) == sha256_text(src):
-                    rec['status'] = 'SKIPPED_ALREADY_APPLIED'
-                    rec['hash_after'] = rec['hash_before']
-                    continue
-                file_cache[file_abs] = patched
-                rec['status'] = 'APPLIED'
-                rec['hash_after'] = sha256_text(patched)
-
-            elif op_kind in ('INSERT_AFTER', 'INSERT_BEFORE'):
-                if op_kind == 'INSERT_AFTER':
-                    insert_line = end_line
-                    ref_line = src.splitlines(True)[start_line - 1]
-                else:
-                    insert_line = start_line - 1
-                    ref_line = src.splitlines(True)[start_line - 1]
-
-                indent = get_line_indent(ref_line)
-
-                sig_line = _first_sig_line(op.get('body'), op.get('sig'))
-                def_name = _def_name_from_sig(sig_line)
-
-                if def_name and _has_def_anywhere(src, def_name):
-                    rec['status'] = 'SKIPPED_ALREADY_PRESENT'
-                    rec['hash_after'] = rec['hash_before']
-                    continue
-                if (not def_name) and sig_line and (sig_line in src):
-                    rec['status'] = 'SKIPPED_ALREADY_PRESENT'
-                    rec['hash_after'] = rec['hash_before']
-                    continue
-
-                patched = insert_after_lines(src, insert_line, op.get('body'), indent, tight=False)
-                if sha256_text(patched) == sha256_text(src):
-                    rec['status'] = 'SKIPPED_ALREADY_PRESENT'
-                    rec['hash_after'] = rec['hash_before']
-                    continue
-
-                file_cache[file_abs] = patched
-                rec['status'] = 'APPLIED'
-                rec['hash_after'] = sha256_text(patched)
-
-            elif op_kind == 'INSERT_INTO':
-                anchor = op.get('anchor')
-                expect = op.get('expect', 1)
-                occurrence = op.get('occurrence', 1)
-                match_mode = op.get('match_mode', 'exact')
-                indent_mode = op.get('indent_mode', 'auto')
-                position = op.get('position', 'after')
-                code = op.get('code', '')
-
-                if not anchor:
-                    rec['status'] = 'FAILED_PARSE'
-                    rec['message'] = 'INSERT_INTO requires ANCHOR'
-                    continue
-
-                hits = _find_anchor_hits(src.splitlines(), start_line, end_line, anchor, match_mode)
-                if len(hits) != expect:
-                    rec['status'] = 'SKIPPED_ANCHOR_MISMATCH'
-                    rec['message'] = _anchor_mismatch_msg(anchor, len(hits), expect, src.splitlines(), start_line, end_line)
-                    continue
-
-                if occurrence < 1 or occurrence > len(hits):
-                    rec['status'] = 'FAILED_PARSE'
-                    rec['message'] = 'OCCURRENCE %d out of range (1..%d)' % (occurrence, len(hits))
-                    continue
-
-                anchor_lineno, anchor_line_text = hits[occurrence - 1]
-                anchor_indent = get_line_indent(anchor_line_text)
-
-                if indent_mode == 'same':
-                    insert_indent = anchor_indent
-                elif indent_mode == 'child':
-                    opens_block = anchor_line_text.rstrip().endswith(':')
-                    has_deeper = any(
-                        bl.strip() and len(get_line_indent(bl)) > len(anchor_indent)
-                        for bl in src.splitlines()[anchor_lineno:end_line]
-                    )
-                    if not opens_block and not has_deeper:
-                        rec['status'] = 'FAILED_PARSE'
-                        rec['message'] = 'INDENT: child refused - anchor does not open a block'
-                        continue
-                    insert_indent = anchor_indent + '    '
-                else:
-                    if anchor_line_text.rstrip().endswith(':'):
-                        insert_indent = anchor_indent + '    '
-                    else:
-                        insert_indent = anchor_indent
-
-                sig_line = (op.get('sig') or '').strip()
-                if sig_line and sig_line in src:
-                    rec['status'] = 'SKIPPED_ALREADY_PRESENT'
-                    rec['hash_after'] = rec['hash_before']
-                    continue
-
-                if position == 'before':
-                    insert_line = anchor_lineno - 1
-                else:
-                    insert_line = anchor_lineno
-
-                patched = insert_after_lines(src, insert_line, code, insert_indent, tight=True)
-                if sha256_text(patched) == sha256_text(src):
-                    rec['status'] = 'SKIPPED_ALREADY_PRESENT'
-                    rec['hash_after'] = rec['hash_before']
-                    continue
-
-                file_cache[file_abs] = patched
-                rec['status'] = 'APPLIED'
-                rec['hash_after'] = sha256_text(patched)
-
-            elif op_kind == 'REPLACE_LINE':
-                anchor = op.get('anchor')
-                expect = op.get('expect', 1)
-                occurrence = op.get('occurrence', 1)
-                match_mode = op.get('match_mode', 'exact')
-                code = (op.get('code', '') or '').strip()
-
-                if not anchor:
-                    rec['status'] = 'FAILED_PARSE'
-                    rec['message'] = 'REPLACE_LINE requires ANCHOR'
-                    continue
-
-                src_lines_raw = src.splitlines(True)
-                hits = _find_anchor_hits([ln.rstrip("\n") for ln in src_lines_raw], start_line, end_line, anchor, match_mode)
-
-                if len(hits) != expect:
-                    rec['status'] = 'SKIPPED_ANCHOR_MISMATCH'
-                    rec['message'] = _anchor_mismatch_msg(anchor, len(hits), expect, src.splitlines(), start_line, end_line)
-                    continue
-
-                if occurrence < 1 or occurrence > len(hits):
-                    rec['status'] = 'FAILED_PARSE'
-                    rec['message'] = 'OCCURRENCE %d out of range (1..%d)' % (occurrence, len(hits))
-                    continue
-
-                anchor_lineno, anchor_line_text = hits[occurrence - 1]
-                line_indent = get_line_indent(anchor_line_text)
-                new_line = line_indent + code + '\n'
-
-                if new_line.rstrip() == anchor_line_text.rstrip():
-                    rec['status'] = 'SKIPPED_ALREADY_APPLIED'
-                    rec['hash_after'] = rec['hash_before']
-                    continue
-
-                new_src_lines = src_lines_raw[:anchor_lineno - 1] + [new_line] + src_lines_raw[anchor_lineno:]
-                patched = ''.join(new_src_lines)
-
-                file_cache[file_abs] = patched
-                rec['status'] = 'APPLIED'
-                rec['hash_after'] = sha256_text(patched)
-
-            elif op_kind == 'REPLACE_LINES':
-                anchor_start = op.get('anchor_start')
-                anchor_end = op.get('anchor_end')
-                match_mode = op.get('match_mode', 'exact')
-                code = op.get('code', '')
-
-                if not anchor_start or not anchor_end:
-                    rec['status'] = 'FAILED_PARSE'
-                    rec['message'] = 'REPLACE_LINES requires ANCHOR_START and ANCHOR_END'
-                    continue
-
-                src_lines_stripped = [ln.rstrip("\n") for ln in src.splitlines(True)]
-                hits_s = _find_anchor_hits(src_lines_stripped, start_line, end_line, anchor_start, match_mode)
-                hits_e = _find_anchor_hits(src_lines_stripped, start_line, end_line, anchor_end, match_mode)
-
-                if len(hits_s) != 1:
-                    rec['status'] = 'SKIPPED_ANCHOR_MISMATCH'
-                    rec['message'] = 'ANCHOR_START %r matched %d times, expected 1' % (anchor_start, len(hits_s))
-                    continue
-                if len(hits_e) != 1:
-                    rec['status'] = 'SKIPPED_ANCHOR_MISMATCH'
-                    rec['message'] = 'ANCHOR_END %r matched %d times, expected 1' % (anchor_end, len(hits_e))
-                    continue
-
-                line_s, _ = hits_s[0]
-                line_e, _ = hits_e[0]
-                if line_e < line_s:
-                    rec['status'] = 'FAILED_PARSE'
-                    rec['message'] = 'ANCHOR_END appears before ANCHOR_START in source'
-                    continue
-
-                patched = replace_lines(src, line_s, line_e, code)
-                if sha256_text(patched) == sha256_text(src):
-                    rec['status'] = 'SKIPPED_ALREADY_APPLIED'
-                    rec['hash_after'] = rec['hash_before']
-                    continue
-                file_cache[file_abs] = patched
-                rec['status'] = 'APPLIED'
-                rec['hash_after'] = sha256_text(patched)
-
-            elif op_kind in ('APPEND_INTO', 'PREPEND_INTO'):
-                code = op.get('body', '')
-                src_lines_list = src.splitlines(True)
-                block_lines = src_lines_list[start_line - 1 : end_line]
-
-                if op_kind == 'PREPEND_INTO':
-                    # Insert right after the def/class header line
-                    ref_line = src_lines_list[start_line - 1] if src_lines_list else ''
-                    insert_indent = get_line_indent(ref_line) + '    '
-                    insert_pos = start_line
-                else:
-                    # Find last non-blank line in block, insert after it
-                    last_content_idx = None
-                    for i, ln in enumerate(block_lines):
-                        if ln.strip():
-                            last_content_idx = i
-                    if last_content_idx is None:
-                        last_content_idx = len(block_lines) - 1
-                    ref_line = block_lines[last_content_idx] if block_lines else ''
-                    insert_indent = get_line_indent(ref_line)
-                    insert_pos = start_line - 1 + last_content_idx + 1
-
-                sig_line = (op.get('sig') or '').strip()
-                if sig_line and sig_line in src:
-                    rec['status'] = 'SKIPPED_ALREADY_PRESENT'
-                    rec['hash_after'] = rec['hash_before']
-                    continue
-
-                patched = insert_after_lines(src, insert_pos, code, insert_indent, tight=True)
-                if sha256_text(patched) == sha256_text(src):
-                    rec['status'] = 'SKIPPED_ALREADY_PRESENT'
-                    rec['hash_after'] = rec['hash_before']
-                    continue
-                file_cache[file_abs] = patched
-                rec['status'] = 'APPLIED'
-                rec['hash_after'] = sha256_text(patched)
-
-            elif op_kind == 'REPLACE_EXPR':
-                anchor = op.get('anchor')
-                expect = op.get('expect', 1)
-                occurrence = op.get('occurrence', 1)
-                match_mode = op.get('match_mode', 'exact')
-                old_expr = op.get('old_expr')
-                new_expr = op.get('new_expr')
-
-                if not anchor:
-                    rec['status'] = 'FAILED_PARSE'
-                    rec['message'] = 'REPLACE_EXPR requires ANCHOR'
-                    continue
-                if old_expr is None or new_expr is None:
-                    rec['status'] = 'FAILED_PARSE'
-                    rec['message'] = 'REPLACE_EXPR requires OLD and NEW'
-                    continue
-
-                src_lines_raw = src.splitlines(True)
-                hits = _find_anchor_hits([ln.rstrip("\n") for ln in src_lines_raw], start_line, end_line, anchor, match_mode)
-
-                if len(hits) != expect:
-                    rec['status'] = 'SKIPPED_ANCHOR_MISMATCH'
-                    rec['message'] = _anchor_mismatch_msg(anchor, len(hits), expect, src.splitlines(), start_line, end_line)
-                    continue
-                if occurrence < 1 or occurrence > len(hits):
-                    rec['status'] = 'FAILED_PARSE'
-                    rec['message'] = 'OCCURRENCE %d out of range (1..%d)' % (occurrence, len(hits))
-                    continue
-
-                anchor_lineno, anchor_line_text = hits[occurrence - 1]
-                if old_expr not in anchor_line_text:
-                    rec['status'] = 'SKIPPED_ANCHOR_MISMATCH'
-                    rec['message'] = 'OLD %r not found in anchor line: %r' % (old_expr, anchor_line_text.strip())
-                    continue
-
-                new_line_text = anchor_line_text.replace(old_expr, new_expr, 1)
-                if new_line_text == anchor_line_text:
-                    rec['status'] = 'SKIPPED_ALREADY_APPLIED'
-                    rec['hash_after'] = rec['hash_before']
-                    continue
-
-                if not new_line_text.endswith('\n'):
-                    new_line_text += '\n'
-                new_src_lines = src_lines_raw[:anchor_lineno - 1] + [new_line_text] + src_lines_raw[anchor_lineno:]
-                patched = ''.join(new_src_lines)
-                file_cache[file_abs] = patched
-                rec['status'] = 'APPLIED'
-                rec['hash_after'] = sha256_text(patched)
-
-            else:
+            handler = op_handlers.get(op_kind)
+            if handler is None:
                 rec['status'] = 'FAILED_PARSE'
                 rec['message'] = 'Unsupported op: ' + str(op_kind)
+            else:
+                handler(op_kind, op, rec, file_abs, src, lines, start_line, end_line)
 
         except Exception as e:
             rec['status'] = 'FAILED_PARSE'
             rec['message'] = type(e).__name__ + ': ' + str(e)
 
+    if carry_index:
+        for file_abs, is_carried in carried.items():
+            if is_carried:
+                to_verify.append((file_cache[file_abs], file_index[file_abs]))
+        for src, index in to_verify:
+            try:
+                ok = same_symbol_ranges(build_symbol_index(src), index)
+            except Exception:
+                ok = False
+            if not ok:
+                return apply_ops(ops, project_root, default_file_abs, carry_index=False)
+
     return results, touched_files, file_cache
 
 
@@ -1135,13 +1575,14 @@ def runs_root(project_root):
 
 def list_runs(project_root):
     rr = runs_root(project_root)
-    if not os.path.isdir(rr):
+    # scandir entries carry the file type, so is_dir() needs no extra stat
+    # (it still follows a symlinked run dir, like isdir did)
+    try:
+        with os.scandir(rr) as it:
+            # .ast_cache and other housekeeping dirs are not runs
+            items = [e.name for e in it if not e.name.startswith(".") and e.is_dir()]
+    except OSError:
         return []
-    items = []
-    for name in os.listdir(rr):
-        p = os.path.join(rr, name)
-        if os.path.isdir(p):
-            items.append(name)
     items.sort(reverse=True)
     return items
 
@@ -1149,50 +1590,87 @@ def prune_runs(project_root, keep_n=KEEP_RUNS):
     rr = runs_root(project_root)
     if not os.path.isdir(rr):
         return
+    # the AST cache has its own cap, so trim it even when no run is old enough to drop
+    prune_ast_cache(project_root)
     runs = list_runs(project_root)
     if keep_n <= 0 or len(runs) <= keep_n:
         return
     old = runs[keep_n:]
     for name in old:
-        p = os.path.join(rr, name)
+        shutil.rmtree(os.path.join(rr, name), ignore_errors=True)
+
+_prune_lock = threading.Lock()   # one prune at a time when runs are started back to back
+
+def prune_runs_in_background(project_root, keep_n=KEEP_RUNS):
+    """
+    prune_runs off the UI path. Not a daemon thread: interpreter exit waits for it,
+    so a run directory is never left half-deleted.
+    """
+    def work():
+        with _prune_lock:
+            prune_runs(project_root, keep_n)
+    threading.Thread(target=work, name="prune_runs").start()
+
+def prune_ast_cache(project_root, keep_n=AST_CACHE_MAX_FILES):
+    cache_dir = os.path.join(runs_root(project_root), AST_CACHE_DIRNAME)
+    if not os.path.isdir(cache_dir):
+        return
+    try:
+        names = os.listdir(cache_dir)
+    except OSError:
+        return
+    def _mtime(p):
+        # an entry replaced or pruned since listdir sorts last instead of aborting the prune
         try:
-            # recursive delete
-            for root, dirs, files in os.walk(p, topdown=False):
-                for fn in files:
-                    try: os.remove(os.path.join(root, fn))
-                    except Exception: pass
-                for dn in dirs:
-                    try: os.rmdir(os.path.join(root, dn))
-                    except Exception: pass
-            try: os.rmdir(p)
-            except Exception: pass
-        except Exception:
-            pass
+            return os.path.getmtime(p)
+        except OSError:
+            return 0
+    stale = time.time() - AST_CACHE_TMP_GRACE
+    entries, dead = [], []
+    for n in names:
+        p = os.path.join(cache_dir, n)
+        if not n.endswith(".tmp"):
+            entries.append(p)
+        elif _mtime(p) < stale:
+            dead.append(p)   # a live writer replaces its .tmp within moments; this one died
+    entries.sort(key=_mtime, reverse=True)
+    for p in dead + entries[keep_n:]:
+        try: os.remove(p)
+        except Exception: pass
+
+SNAPSHOT_TAR = "snapshots.tar"
+
+def _snapshot_member(rel):
+    return rel.replace(os.sep, "/")
 
 def write_run_artifacts(project_root, stamp, bundle_text, results, touched_files, file_cache):
     run_dir = os.path.join(runs_root(project_root), stamp)
-    snap_dir = os.path.join(run_dir, "snapshots")
     log_dir = os.path.join(run_dir, "logs")
-    ensure_dir(snap_dir)
     ensure_dir(log_dir)
 
     # Save bundle
-    write_text(os.path.join(run_dir, "bundle.txt"), (bundle_text or "").strip() + "\n")
+    write_text(os.path.join(run_dir, "bundle.txt"), (bundle_text or "").strip() + "\n", mkdirs=False)
 
-    # Save snapshots (BEFORE for touched files)
+    # Save snapshots (BEFORE for touched files): one sequential tar per run
     touched_list = []
-    for file_abs, meta in touched_files.items():
-        rel = os.path.relpath(file_abs, project_root)
-        snap_path = os.path.join(snap_dir, rel)
-        write_text(snap_path, meta.get("before") or "")
-        touched_list.append({
-            "rel": rel,
-            "snapshot_rel": os.path.relpath(snap_path, run_dir),
-            "before_sha": sha256_text(meta.get("before") or ""),
-            "after_sha": sha256_text(file_cache.get(os.path.realpath(file_abs), meta.get("before") or "")),
-            "compile_ok": meta.get("compile_ok"),
-            "compile_error": meta.get("compile_error", "")
-        })
+    mtime = time.time()
+    with tarfile.open(os.path.join(run_dir, SNAPSHOT_TAR), "w") as tf:
+        for file_abs, meta in touched_files.items():
+            rel = meta.get("rel") or os.path.relpath(file_abs, project_root)
+            member = _snapshot_member(rel)
+            data = (meta.get("before") or "").encode("utf-8")
+            info = tarfile.TarInfo(member)
+            info.size = len(data)
+            info.mtime = mtime
+            tf.addfile(info, io.BytesIO(data))
+            touched_list.append({
+                "rel": rel,
+                "snapshot_rel": SNAPSHOT_TAR + "/" + member,
+                "before_sha": meta.get("before_sha") or hash_source(meta.get("before") or ""),
+                "after_sha": hash_source(file_cache.get(file_abs, meta.get("before") or "")),
+                "compile_ok": meta.get("compile_ok"),
+                "compile_error": meta.get("compile_error", "")
+            })
 
     # Logs
     summary_lines = []
@@ -1204,34 +1682,50 @@ def write_run_artifacts(project_root, stamp, bundle_text, results, touched_files
         summary_lines.append(f"{st:22} {r.get('op','?'):12} {r.get('target','?')}  [{r.get('file','?')}]  {r.get('message','')}".rstrip())
     summary_lines.append("")
     summary_path = os.path.join(log_dir, "run_summary.txt")
-    write_text(summary_path, "\n".join(summary_lines) + "\n")
+    write_text(summary_path, "\n".join(summary_lines) + "\n", mkdirs=False)
 
+    # one encoder for every record, one write for the whole log
+    encode = json.JSONEncoder(ensure_ascii=False).encode
     jsonl_path = os.path.join(log_dir, "run_log.jsonl")
-    with open(jsonl_path, "w", encoding="utf-8") as f:
-        for r in results:
-            f.write(json.dumps(r, ensure_ascii=False) + "\n")
+    write_text(jsonl_path, "".join([encode(r) + "\n" for r in results]), mkdirs=False)
 
     # Manifest
     manifest = {
         "stamp": stamp,
         "root": os.path.abspath(project_root),
-        "bundle_sha": sha256_text(bundle_text or ""),
+        "bundle_sha": hash_source(bundle_text),
         "touched": touched_list,
         "results": results,
     }
-    write_text(os.path.join(run_dir, "manifest.json"), json.dumps(manifest, ensure_ascii=False, indent=2) + "\n")
+    manifest_path = os.path.join(run_dir, "manifest.json")
+    if len(results) <= MANIFEST_INDENT_MAX_RESULTS:
+        write_text(manifest_path, json.dumps(manifest, ensure_ascii=False, indent=2) + "\n", mkdirs=False)
+    else:
+        # big runs: stream compact JSON instead of building the pretty-printed string first
+        with open(manifest_path, "w", encoding="utf-8", buffering=1 << 20) as f:
+            json.dump(manifest, f, ensure_ascii=False, separators=(",", ":"))
+            f.write("\n")
 
     return run_dir, summary_path, jsonl_path
 
-def verify_write_and_maybe_rollback(touched_files, file_cache):
-    """
-    Write updated files and compile check. Rollback per-file on compile failure if configured.
-    """
-    for file_abs, meta in touched_files.items():
-        real_abs = os.path.realpath(file_abs)
-        new_src = file_cache.get(real_abs, file_cache.get(file_abs, meta["before"]))
-        meta["after"] = new_src
+def _verify_one(file_abs, meta, new_src):
+    """Compile, write and check one file; results and any rollback stay in its meta."""
+    # every op on this file skipped: nothing to write, read back or roll back
+    changed = new_src != meta["before"]
 
+    # Compile the in-memory source first: with rollback on, a file that would fail
+    # the check is never written, which leaves the same state as write + rollback.
+    try:
+        smoke_compile(new_src, filename=file_abs)
+        compile_error = None
+    except Exception as e:
+        compile_error = type(e).__name__ + ": " + str(e)
+    if compile_error is not None and (ROLLBACK_ON_COMPILE_FAIL or not changed):
+        meta["compile_ok"] = False
+        meta["compile_error"] = compile_error
+        return
+
+    if changed:
         try:
             write_text(file_abs, new_src)
         except Exception as e:
@@ -1242,10 +1736,15 @@ def verify_write_and_maybe_rollback(touched_files, file_cache):
                     write_text(file_abs, meta["before"])
                 except Exception:
                     pass
-            continue
+            return
 
+    if changed and (VERIFY_READBACK or os.linesep == "\n"):
         try:
-            disk_src = read_text(file_abs)
+            if VERIFY_READBACK:
+                mismatch = read_text(file_abs) != new_src
+            else:
+                # text mode wrote the UTF-8 of new_src untranslated, so its size must match
+                mismatch = os.stat(file_abs).st_size != len(new_src.encode("utf-8"))
         except Exception as e:
             meta["compile_ok"] = False
             meta["compile_error"] = "READBACK_FAIL " + type(e).__name__ + ": " + str(e)
@@ -1254,9 +1753,9 @@ def verify_write_and_maybe_rollback(touched_files, file_cache):
                     write_text(file_abs, meta["before"])
                 except Exception:
                     pass
-            continue
+            return
 
-        if sha256_text(disk_src) != sha256_text(new_src):
+        if mismatch:
             meta["compile_ok"] = False
             meta["compile_error"] = "WRITEBACK_MISMATCH: file on disk != intended content"
             if ROLLBACK_ON_COMPILE_FAIL:
@@ -1264,26 +1763,37 @@ def verify_write_and_maybe_rollback(touched_files, file_cache):
                     write_text(file_abs, meta["before"])
                 except Exception:
                     pass
-            continue
+            return
 
-        try:
-            smoke_compile(disk_src, filename=file_abs)
-            meta["compile_ok"] = True
-            meta["compile_error"] = ""
-        except Exception as e:
-            meta["compile_ok"] = False
-            meta["compile_error"] = type(e).__name__ + ": " + str(e)
-            if ROLLBACK_ON_COMPILE_FAIL:
-                try:
-                    write_text(file_abs, meta["before"])
-                except Exception:
-                    pass
+    # only reached with a compile error when rollback is off: the file stays written
+    meta["compile_ok"] = compile_error is None
+    meta["compile_error"] = compile_error or ""
+
+def verify_write_and_maybe_rollback(touched_files, file_cache):
+    """
+    Write updated files and compile check. Rollback per-file on compile failure if configured.
+
+    Files are independent (each task only touches its own meta), so with more than
+    one file the write / read-back / compile steps overlap on a small thread pool.
+    """
+    tasks = []
+    for file_abs, meta in touched_files.items():
+        # apply_ops keys touched_files and file_cache by the same realpath
+        new_src = file_cache.get(file_abs, meta["before"])
+        meta["after"] = new_src
+        tasks.append((file_abs, meta, new_src))
+
+    if len(tasks) <= 1:
+        for task in tasks:
+            _verify_one(*task)
+        return
+    with ThreadPoolExecutor(max_workers=min(VERIFY_WORKERS, len(tasks))) as ex:
+        list(ex.map(lambda task: _verify_one(*task), tasks))
 
 def propagate_compile_to_results(project_root, results, touched_files):
     by_rel = {}
     for file_abs, meta in touched_files.items():
-        rel = os.path.relpath(file_abs, project_root)
-        by_rel[rel] = meta
+        by_rel[meta.get("rel") or os.path.relpath(file_abs, project_root)] = meta
 
     for r in results:
         rel = r.get("file")
@@ -1311,9 +1821,16 @@ def revert_run(project_root, run_stamp):
         return False, "Manifest unreadable: " + type(e).__name__ + ": " + str(e)
 
     touched = manifest.get("touched") or []
-    snap_dir = os.path.join(run_dir, "snapshots")
-    if not os.path.isdir(snap_dir):
-        return False, "Snapshots folder missing for run: " + run_stamp
+    tar_path = os.path.join(run_dir, SNAPSHOT_TAR)
+    snap_dir = os.path.join(run_dir, "snapshots")   # runs written before snapshots.tar
+    tf = None
+    if os.path.isfile(tar_path):
+        try:
+            tf = tarfile.open(tar_path, "r")
+        except Exception as e:
+            return False, "Snapshots unreadable: " + type(e).__name__ + ": " + str(e)
+    elif not os.path.isdir(snap_dir):
+        return False, "Snapshots missing for run: " + run_stamp
 
     # Restore each snapshot file to its original location
     restored = 0
@@ -1324,15 +1841,19 @@ def revert_run(project_root, run_stamp):
         rel = t.get("rel")
         if not rel:
             continue
-        snap_path = os.path.join(snap_dir, rel)
         target_path = os.path.abspath(os.path.join(project_root, rel))
         try:
-            src = read_text(snap_path)
+            if tf is not None:
+                src = tf.extractfile(_snapshot_member(rel)).read().decode("utf-8")
+            else:
+                src = read_text(os.path.join(snap_dir, rel))
             write_text(target_path, src)
             restored += 1
         except Exception as e:
             failed += 1
             errors.append(f"{rel}: {type(e).__name__}: {e}")
+    if tf is not None:
+        tf.close()
 
     if failed:
         msg = f"Revert completed with errors. Restored {restored}, failed {failed}."
@@ -1352,13 +1873,17 @@ def determine_root_and_default_file():
     Default file = current editor file path if available else this script.
     """
     cur_path = _editor_path()
+    # isfile stays uncached: the open file can be deleted or renamed between runs
     if cur_path and os.path.isfile(cur_path):
-        root = os.path.dirname(os.path.abspath(cur_path))
-        default_file_abs = os.path.abspath(cur_path)
-        return root, default_file_abs, cur_path
+        return _root_for_path(cur_path) + (cur_path,)
     # fallback
-    this_file = os.path.abspath(__file__)
-    return os.path.dirname(this_file), this_file, None
+    return _root_for_path(__file__) + (None,)
+
+@lru_cache(maxsize=4)
+def _root_for_path(path):
+    # (root dir, absolute file); one entry per editor tab seen this process
+    path_abs = os.path.abspath(path)
+    return os.path.dirname(path_abs), path_abs
 
 def current_file_dirty(cur_path):
     """
@@ -1367,13 +1892,34 @@ def current_file_dirty(cur_path):
     if not cur_path or not os.path.isfile(cur_path):
         return False
     try:
-        disk = read_text(cur_path)
+        disk = read_text_cached(cur_path)
     except Exception:
         disk = None
     buf = _editor_text()
     if disk is None:
         return False
-    return sha256_text(disk) != sha256_text(buf)
+    return disk != (buf or "")
+
+def _same_file_in(path, candidates):
+    """True if path names the same file as any candidate (one stat each; no realpath walk)."""
+    try:
+        st = os.stat(path)
+    except OSError:
+        return False
+    for c in candidates:
+        try:
+            if os.path.samestat(st, os.stat(c)):
+                return True
+        except OSError:
+            pass
+    return False
+
+def _packet_row(r):
+    """One run-packet line per result: status | op | target | file [:: message]."""
+    row = "- %s | %s | %s | %s" % (r.get("status") or "UNKNOWN", r.get("op") or "?",
+                                   r.get("target") or "?", r.get("file") or "?")
+    msg = r.get("message")
+    return row + " :: " + msg if msg else row
 
 def apply_from_clipboard(project_root, default_file_abs, cur_path, dry_run=False):
     if clipboard is None:
@@ -1385,31 +1931,42 @@ def apply_from_clipboard(project_root, default_file_abs, cur_path, dry_run=False
         _hud("Clipboard empty", "error", 1.2)
         return
 
-    ops, _bundle_default = parse_patch_bundle(bundle_text)
+    ops, _bundle_default = parse_patch_bundle_cached(bundle_text)
     if not ops:
         _hud("No operations found in clipboard", "error", 1.2)
         return
 
     # Preflight: if current editor file is among targets and dirty -> refuse
     # (We can only safely detect "dirty" for the current file.)
-    targets_abs = set()
-    for op in ops:
-        try:
-            file_ref, _cls, _meth = parse_target(op.get("target"), default_file_abs, op_default_file=op.get("default_file"))
-            file_abs = os.path.realpath(os.path.abspath(
-                file_ref if os.path.isabs(file_ref)
-                else os.path.join(project_root, file_ref)
-            ))
-            targets_abs.add(file_abs)
-        except Exception:
-            pass
-
-    if cur_path and os.path.realpath(os.path.abspath(cur_path)) in targets_abs:
+    # With no editor file there is nothing to match, so the target pass is skipped.
+    cur_targeted = False
+    if cur_path:
+        # Many ops share a file: collect the distinct refs first, then resolve each once.
+        file_refs = set()
+        for op in ops:
+            try:
+                file_ref, _cls, _meth = _parse_target_cached(op.get("target"), default_file_abs, op_default_file=op.get("default_file"))
+                file_refs.add(file_ref)
+            except Exception:
+                pass
+        # project_root is already absolute, so join + normpath is enough for the
+        # common case; symlinked spellings of the same file are caught by stat below.
+        targets_abs = {os.path.normpath(os.path.join(project_root, file_ref)) for file_ref in file_refs}
+        cur_abs = os.path.normpath(os.path.abspath(cur_path))
+        cur_targeted = cur_abs in targets_abs or _same_file_in(cur_abs, targets_abs)
+
+    cur_before = None   # pre-apply disk text of the open file, which its buffer matches
+    if cur_targeted:
         if current_file_dirty(cur_path):
             _alert("AST Patcher", "Refused: the current file has unsaved edits.\n\nSave it, then run again.", "OK")
             return
+        try:
+            cur_before = read_text_cached(cur_path)   # just cached by the dirty check
+        except Exception:
+            pass
 
     stamp = now_stamp()
+    set_disk_cache_dir(os.path.join(runs_root(project_root), AST_CACHE_DIRNAME), writable=not dry_run)
 
     # Apply in memory
     results, touched_files, file_cache = apply_ops(ops, project_root, default_file_abs)
@@ -1418,53 +1975,56 @@ def apply_from_clipboard(project_root, default_file_abs, cur_path, dry_run=False
         # Write + compile verify (+ rollback)
         verify_write_and_maybe_rollback(touched_files, file_cache)
         propagate_compile_to_results(project_root, results, touched_files)
-        # Persist run artifacts
-        run_dir, summary_path, jsonl_path = write_run_artifacts(project_root, stamp, bundle_text, results, touched_files, file_cache)
-        prune_runs(project_root, KEEP_RUNS)
-    else:
-        run_dir = summary_path = jsonl_path = '(dry run — nothing written)'
-
-    # Console lines
-    if PRINT_OP_LINES_TO_CONSOLE:
-        for r in results:
-            print((r.get("status") or "UNKNOWN") + " | " + (r.get("op") or "?") + " | " + (r.get("target") or "?"))
 
-    # Reload current editor buffer if it was targeted (skip in dry-run)
-    if not dry_run and cur_path and os.path.realpath(os.path.abspath(cur_path)) in targets_abs:
-        try:
-            new_disk = read_text(cur_path)
-            _editor_replace_all(new_disk)
-        except Exception:
-            pass
-
-    # Build small run packet
-    applied = sum(1 for r in results if r.get("status") == "APPLIED")
-    failed = sum(1 for r in results if (r.get("status") or "").startswith("FAILED"))
+    # Run totals
+    statuses = [r.get("status") or "" for r in results]
+    applied = statuses.count("APPLIED")
+    failed = sum(1 for st in statuses if st.startswith("FAILED"))
     skipped = len(results) - applied - failed
 
-    packet = []
-    packet.append("=== AST PATCH RUN PACKET ===")
-    packet.append("Run: " + stamp)
-    packet.append("Root: " + os.path.abspath(project_root))
-    packet.append("Run dir: " + run_dir)
-    packet.append("Summary: " + summary_path)
-    packet.append("JSONL: " + jsonl_path)
-    packet.append("")
-    packet.append(f"Totals: APPLIED={applied} SKIPPED={skipped} FAILED={failed}")
-    packet.append("")
-    packet.append("Ops:")
-    for r in results:
-        st = r.get("status") or "UNKNOWN"
-        opn = r.get("op") or "?"
-        tgt = r.get("target") or "?"
-        rel = r.get("file") or "?"
-        msg = r.get("message") or ""
-        if msg:
-            packet.append(f"- {st} | {opn} | {tgt} | {rel} :: {msg}")
+    # Console lines
+    if PRINT_OP_LINES_TO_CONSOLE and results:
+        # one write for the whole list rather than one per result
+        print("\n".join((r.get("status") or "UNKNOWN") + " | " + (r.get("op") or "?") + " | " + (r.get("target") or "?")
+                        for r in results))
+
+    if not dry_run:
+        # Reload current editor buffer if it was targeted
+        if cur_targeted:
+            try:
+                # write_text drops the cache entry, so an unwritten file is not re-read;
+                # if its text is unchanged the buffer already shows it and keeps its cursor
+                new_disk = read_text_cached(cur_path)
+                if new_disk != cur_before:
+                    _editor_replace_all(new_disk)
+            except Exception:
+                pass
+        # The outcome is final once files are verified: report it before the housekeeping
+        if failed:
+            _hud(f"Applied {applied} • Failed {failed} • Skipped {skipped}", "error", 1.3)
         else:
-            packet.append(f"- {st} | {opn} | {tgt} | {rel}")
+            _hud(f"Applied {applied} • Skipped {skipped}", "success", 1.2)
+        # Persist run artifacts
+        run_dir, summary_path, jsonl_path = write_run_artifacts(project_root, stamp, bundle_text, results, touched_files, file_cache)
+        prune_runs_in_background(project_root, KEEP_RUNS)
+    else:
+        run_dir = summary_path = jsonl_path = '(dry run — nothing written)'
 
+    # Build small run packet; it only goes to the clipboard, so skip it when that is off
     if ALWAYS_COPY_RUN_PACKET and clipboard is not None:
+        packet = [
+            "=== AST PATCH RUN PACKET ===",
+            "Run: " + stamp,
+            "Root: " + os.path.abspath(project_root),
+            "Run dir: " + run_dir,
+            "Summary: " + summary_path,
+            "JSONL: " + jsonl_path,
+            "",
+            f"Totals: APPLIED={applied} SKIPPED={skipped} FAILED={failed}",
+            "",
+            "Ops:",
+        ]
+        packet.extend(map(_packet_row, results))
         try:
             clipboard.set("\n".join(packet).strip() + "\n")
         except Exception:
@@ -1475,10 +2035,6 @@ def apply_from_clipboard(project_root, default_file_abs, cur_path, dry_run=False
         _alert("DRY RUN — nothing written",
                f"APPLIED={applied}  SKIPPED={skipped}  FAILED={failed}\n\n" + "\n".join(summary_lines),
                "OK")
-    elif failed:
-        _hud(f"Applied {applied} • Failed {failed} • Skipped {skipped}", "error", 1.3)
-    else:
-        _hud(f"Applied {applied} • Skipped {skipped}", "success", 1.2)
 
 def revert_last_run_ui(project_root, cur_path):
     runs = list_runs(project_root)
@@ -1486,11 +2042,13 @@ def revert_last_run_ui(project_root, cur_path):
         _hud("No runs to revert", "error", 1.2)
         return
 
-    # Pick run: last by default, or list dialog if available
+    # Pick run: last by default, or list dialog if available and there is a choice;
+    # a single run still gets the confirm alert below, it just skips the picker
     chosen = runs[0]
+    dialogs = _lazy("dialogs") if len(runs) > 1 else None
     if dialogs:
         try:
-            picked = dialogs.list_dialog("Revert which run?", runs[:min(len(runs), KEEP_RUNS)])
+            picked = dialogs.list_dialog("Revert which run?", runs[:KEEP_RUNS])
             if picked:
                 chosen = picked
             else:
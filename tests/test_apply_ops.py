@@ -0,0 +1,112 @@
+import os
+import shutil
+import tempfile
+import unittest
+import importlib.util
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+MODULE_PATH = os.path.join(os.path.dirname(HERE), "ast_patcher_v2 .py")
+
+
+def load_patcher():
+    spec = importlib.util.spec_from_file_location("ast_patcher_v2", MODULE_PATH)
+    mod = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(mod)
+    return mod
+
+
+SRC = '''def a():
+    x = 1
+    return x
+
+
+def b():
+    return 2
+'''
+
+
+class ApplyOpsTests(unittest.TestCase):
+    def setUp(self):
+        self.m = load_patcher()
+        self.root = tempfile.mkdtemp()
+        self.path = os.path.join(self.root, "m.py")
+        with open(self.path, "w", encoding="utf-8") as f:
+            f.write(SRC)
+
+    def tearDown(self):
+        shutil.rmtree(self.root, ignore_errors=True)
+
+    def apply(self, bundle, **kw):
+        ops, _ = self.m.parse_patch_bundle(bundle)
+        return self.m.apply_ops(ops, self.root, self.path, **kw)
+
+    def assertCarryMatchesReparse(self, bundle):
+        carried = self.apply(bundle)
+        reparsed = self.apply(bundle, carry_index=False)
+        self.assertEqual(carried[0], reparsed[0])
+        self.assertEqual(carried[2], reparsed[2])
+
+    def test_carry_index_matches_reparse_for_interior_edits(self):
+        self.assertCarryMatchesReparse(
+            "INSERT_INTO m.py::a\n"
+            "ANCHOR: x = 1\n"
+            "z = 0\n"
+            "REPLACE_LINE m.py::a\n"
+            "ANCHOR: return x\n"
+            "return x + z\n"
+            "PREPEND_INTO m.py::b\n"
+            "w = 1\n"
+            "REPLACE_EXPR m.py::b\n"
+            "ANCHOR: return\n"
+            "OLD: 2\n"
+            "NEW: w + 1\n"
+            "APPEND_INTO m.py::a\n"
+            "pass\n"
+            "INSERT_AFTER m.py::a\n"
+            "def a2():\n"
+            "    return 0\n"
+            "REPLACE_LINE m.py::b\n"
+            "ANCHOR: w = 1\n"
+            "w = 2\n")
+
+    def test_carry_index_matches_reparse_after_breaking_edit(self):
+        # the unterminated string leaves the file unparsable, so the later ops
+        # must fail as a fresh parse would, even though the last one would
+        # close the string and make the end-of-run check pass
+        self.assertCarryMatchesReparse(
+            "APPEND_INTO m.py::a\n"
+            "s = \"\"\"\n"
+            "REPLACE_LINE m.py::b\n"
+            "ANCHOR: return 2\n"
+            "return 5\n"
+            "APPEND_INTO m.py::a\n"
+            "\"\"\"  # closes s\n")
+
+    def test_multiline_replace_line_then_insert_after(self):
+        # the two-line CODE body must not shift where INSERT_AFTER lands
+        results, _, file_cache = self.apply(
+            "REPLACE_LINE m.py::a\n"
+            "ANCHOR: x = 1\n"
+            "x = 1\n"
+            "    y = 2\n"
+            "INSERT_AFTER m.py::b\n"
+            "def c():\n"
+            "    return 3\n")
+        self.assertEqual([r["status"] for r in results], ["APPLIED", "APPLIED"],
+                         [r["message"] for r in results])
+        self.assertEqual(file_cache[os.path.realpath(self.path)], '''def a():
+    x = 1
+    y = 2
+    return x
+
+
+def b():
+    return 2
+
+def c():
+    return 3
+''')
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,88 @@
+import os
+import unittest
+import importlib.util
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+MODULE_PATH = os.path.join(os.path.dirname(HERE), "ast_patcher_v2 .py")
+
+
+def load_patcher():
+    spec = importlib.util.spec_from_file_location("ast_patcher_v2", MODULE_PATH)
+    mod = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(mod)
+    return mod
+
+
+class ParseBundleTests(unittest.TestCase):
+    """Edge cases the line-by-line parser handled; the regex parser must match."""
+
+    def setUp(self):
+        self.m = load_patcher()
+
+    def parse(self, text):
+        return self.m.parse_patch_bundle(text)
+
+    def test_header_with_only_spaces_is_a_parse_error(self):
+        with self.assertRaises(ValueError):
+            self.parse("REPLACE   \n")
+
+    def test_header_with_only_spaces_stays_in_body(self):
+        ops, _ = self.parse("REPLACE m.py::f\ndef f():\n    pass\nREPLACE   \nx = 1\n")
+        self.assertEqual(len(ops), 1)
+        self.assertEqual(ops[0]["body"], "def f():\n    pass\nREPLACE   \nx = 1\n")
+
+    def test_indented_default_file(self):
+        ops, default = self.parse("   DEFAULT_FILE  m.py  \nREPLACE f\ndef f():\n    return 1\n")
+        self.assertEqual(default, "m.py")
+        self.assertEqual(ops[0]["default_file"], "m.py")
+        self.assertEqual(ops[0]["target"], "f")
+
+    def test_indented_default_file_ends_body(self):
+        ops, default = self.parse(
+            "REPLACE m.py::f\n"
+            "def f():\n"
+            "    return 1\n"
+            "    DEFAULT_FILE other.py\n"
+            "REPLACE g\n"
+            "def g():\n"
+            "    pass\n")
+        self.assertEqual(default, "other.py")
+        self.assertEqual([op["body"] for op in ops], ["def f():\n    return 1\n", "def g():\n    pass\n"])
+        self.assertEqual([op["default_file"] for op in ops], [None, "other.py"])
+
+    def test_indented_header_ends_body(self):
+        ops, _ = self.parse(
+            "REPLACE m.py::f\n"
+            "def f():\n"
+            "    return 1\n"
+            "  REPLACE_LINE m.py::f\n"
+            "  ANCHOR: return 1\n"
+            "  return 2\n")
+        self.assertEqual([op["op"] for op in ops], ["REPLACE", "REPLACE_LINE"])
+        self.assertEqual(ops[1]["anchor"], "return 1")
+        self.assertEqual(ops[1]["code"], "  return 2\n")
+        self.assertEqual(ops[1]["sig"], "return 2")
+
+    def test_directive_lines_inside_code_are_code(self):
+        ops, _ = self.parse(
+            "INSERT_INTO m.py::f\n"
+            "ANCHOR: return\n"
+            "POSITION: before\n"
+            "log()\n"
+            "ANCHOR: not a directive\n"
+            "EXPECT: 3\n")
+        op = ops[0]
+        self.assertEqual(op["anchor"], "return")
+        self.assertEqual(op["position"], "before")
+        self.assertEqual(op["expect"], 1)
+        self.assertEqual(op["code"], "log()\nANCHOR: not a directive\nEXPECT: 3\n")
+        self.assertEqual(op["sig"], "log()")
+
+    def test_directive_lines_in_replace_body_are_body(self):
+        ops, _ = self.parse("REPLACE m.py::f\ndef f():\n    ANCHOR: x\n    return 1\n")
+        self.assertEqual(ops[0]["body"], "def f():\n    ANCHOR: x\n    return 1\n")
+        self.assertNotIn("anchor", ops[0])
+
+
+if __name__ == "__main__":
+    unittest.main()
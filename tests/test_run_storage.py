@@ -0,0 +1,97 @@
+import os
+import json
+import shutil
+import tarfile
+import tempfile
+import unittest
+import importlib.util
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+MODULE_PATH = os.path.join(os.path.dirname(HERE), "ast_patcher_v2 .py")
+
+
+def load_patcher():
+    spec = importlib.util.spec_from_file_location("ast_patcher_v2", MODULE_PATH)
+    mod = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(mod)
+    return mod
+
+
+ORIGINAL = {
+    "m.py": "def f():\n    return 1\n",
+    os.path.join("sub", "n.py"): "def g():\n    return 2\n",
+}
+
+BUNDLE = (
+    "REPLACE m.py::f\n"
+    "def f():\n"
+    "    return 10\n"
+    "REPLACE sub/n.py::g\n"
+    "def g():\n"
+    "    return 20\n"
+)
+
+
+class RevertTests(unittest.TestCase):
+    def setUp(self):
+        self.m = load_patcher()
+        self.root = tempfile.mkdtemp()
+        for rel, text in ORIGINAL.items():
+            self.write(rel, text)
+
+    def tearDown(self):
+        shutil.rmtree(self.root, ignore_errors=True)
+
+    def write(self, rel, text):
+        path = os.path.join(self.root, rel)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, "w", encoding="utf-8") as f:
+            f.write(text)
+
+    def read(self, rel):
+        with open(os.path.join(self.root, rel), encoding="utf-8") as f:
+            return f.read()
+
+    def test_apply_then_revert_through_snapshot_tar(self):
+        m = self.m
+        ops, _ = m.parse_patch_bundle(BUNDLE)
+        results, touched, file_cache = m.apply_ops(ops, self.root, os.path.join(self.root, "m.py"))
+        m.verify_write_and_maybe_rollback(touched, file_cache)
+        stamp = m.now_stamp()
+        run_dir = m.write_run_artifacts(self.root, stamp, BUNDLE, results, touched, file_cache)[0]
+
+        self.assertIn("return 10", self.read("m.py"))
+        self.assertIn("return 20", self.read(os.path.join("sub", "n.py")))
+        self.assertFalse(os.path.exists(os.path.join(run_dir, "snapshots")))
+        with tarfile.open(os.path.join(run_dir, m.SNAPSHOT_TAR)) as tf:
+            self.assertEqual(sorted(tf.getnames()), ["m.py", "sub/n.py"])
+
+        ok, msg = m.revert_run(self.root, stamp)
+        self.assertTrue(ok, msg)
+        for rel, text in ORIGINAL.items():
+            self.assertEqual(self.read(rel), text)
+
+    def test_revert_run_from_snapshots_dir(self):
+        # runs written before snapshots.tar keep one file per touched file
+        m = self.m
+        stamp = "20240101_000000"
+        run_dir = os.path.join(m.runs_root(self.root), stamp)
+        touched = []
+        for rel, text in ORIGINAL.items():
+            snap = os.path.join(run_dir, "snapshots", rel)
+            os.makedirs(os.path.dirname(snap), exist_ok=True)
+            with open(snap, "w", encoding="utf-8") as f:
+                f.write(text)
+            touched.append({"rel": rel, "snapshot_rel": os.path.join("snapshots", rel)})
+            self.write(rel, "broken = (\n")
+        with open(os.path.join(run_dir, "manifest.json"), "w", encoding="utf-8") as f:
+            json.dump({"stamp": stamp, "touched": touched, "results": []}, f)
+
+        ok, msg = m.revert_run(self.root, stamp)
+        self.assertTrue(ok, msg)
+        for rel, text in ORIGINAL.items():
+            self.assertEqual(self.read(rel), text)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,72 @@
+import os
+import sys
+import shutil
+import tempfile
+import threading
+import unittest
+import importlib.util
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+MODULE_PATH = os.path.join(os.path.dirname(HERE), "ast_patcher_v2 .py")
+
+
+def load_patcher():
+    spec = importlib.util.spec_from_file_location("ast_patcher_v2", MODULE_PATH)
+    mod = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(mod)
+    return mod
+
+
+class VerifyPoolTests(unittest.TestCase):
+    def setUp(self):
+        self.m = load_patcher()
+        self.root = tempfile.mkdtemp()
+        self.m.set_disk_cache_dir(os.path.join(self.root, "cache"), writable=True)
+        self._interval = sys.getswitchinterval()
+        sys.setswitchinterval(1e-6)   # force frequent thread switches
+
+    def tearDown(self):
+        sys.setswitchinterval(self._interval)
+        shutil.rmtree(self.root, ignore_errors=True)
+
+    def test_hash_source_concurrent_eviction(self):
+        errors = []
+
+        def worker(k):
+            try:
+                for i in range(30000):
+                    self.m.hash_source("x = %d  # %d\n" % (i, k))
+            except Exception as e:
+                errors.append(e)
+
+        threads = [threading.Thread(target=worker, args=(k,)) for k in range(8)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        self.assertEqual(errors, [])
+
+    def test_pool_verifies_many_files_with_disk_cache(self):
+        for rnd in range(5):
+            touched, cache = {}, {}
+            for i in range(24):
+                path = os.path.join(self.root, "f%02d.py" % i)
+                before = "x = %d\n" % i
+                with open(path, "w", encoding="utf-8") as f:
+                    f.write(before)
+                touched[path] = {"rel": os.path.basename(path), "before": before,
+                                 "after": None, "compile_ok": None, "compile_error": ""}
+                cache[path] = "def f():\n    return %d, %d\n" % (rnd, i)
+
+            self.m.verify_write_and_maybe_rollback(touched, cache)
+
+            for path, meta in touched.items():
+                self.assertTrue(meta["compile_ok"], meta["compile_error"])
+                with open(path, encoding="utf-8") as f:
+                    self.assertEqual(f.read(), cache[path])
+        leftovers = [n for n in os.listdir(os.path.join(self.root, "cache")) if n.endswith(".tmp")]
+        self.assertEqual(leftovers, [])
+
+
+if __name__ == "__main__":
+    unittest.main()